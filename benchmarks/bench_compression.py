@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+"""Compares the bytes sent and received, and the time taken, with and
+without gzip, for a large ``list_emails`` and a large multicall batch
+against the local fake server.
+
+Usage: python benchmarks/bench_compression.py [emails]
+"""
+from __future__ import print_function
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+
+from pywebfaction.testing import FakeWebFactionServer, sample_emails  # noqa
+from pywebfaction import WebFactionAPI  # noqa
+from pywebfaction.metrics import CallCounter  # noqa
+from pywebfaction.transport import PooledTransport  # noqa
+
+
+def measure(server, gzip, emails):
+    counter = CallCounter()
+    transport = PooledTransport(
+        use_https=False,
+        accept_gzip_encoding=gzip,
+        encode_threshold=1024 if gzip else None,
+    )
+    api = WebFactionAPI('user', 'password', endpoint=server.endpoint,
+                        transport=transport, observers=[counter])
+
+    start = time.time()
+    assert len(api.list_emails()) >= emails
+    list_time = time.time() - start
+
+    start = time.time()
+    suffix = 'gzip' if gzip else 'plain'
+    with api.batch() as batch:
+        for i in range(emails):
+            batch.create_mailbox('bench%d_%s' % (i, suffix))
+    batch_time = time.time() - start
+
+    transport.close()
+    return (
+        counter.response_bytes['list_emails'],
+        list_time,
+        counter.request_bytes['system.multicall'],
+        batch_time,
+    )
+
+
+def main():
+    emails = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    server = FakeWebFactionServer(emails=sample_emails(emails)).start()
+
+    try:
+        print("%d emails" % emails)
+        print("%-8s %16s %10s %16s %10s" % (
+            '', 'list_emails in', 'ms', 'multicall out', 'ms'
+        ))
+
+        for name, gzip in (('plain', False), ('gzip', True)):
+            received, list_time, sent, batch_time = measure(
+                server, gzip, emails
+            )
+            print("%-8s %16d %10.1f %16d %10.1f" % (
+                name, received, list_time * 1000, sent, batch_time * 1000
+            ))
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
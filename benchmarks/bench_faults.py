@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+"""Times wrapping a batch of faults in ``WebFactionFault``, as a bulk
+job expecting lots of mailbox name collisions would.
+
+Compares parsing every fault eagerly with ``ast.literal_eval`` (as
+pywebfaction used to) against the current lazy parser, both when only
+``exception_type`` is looked at and when ``exception_message`` is too.
+
+Usage: python benchmarks/bench_faults.py [faults]
+"""
+from __future__ import print_function
+
+import ast
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+
+from pywebfaction.exceptions import WebFactionFault  # noqa
+from six.moves import xmlrpc_client  # noqa
+
+
+COLLISION = (
+    "<class 'webfaction_api.exceptions.DataError'>:"
+    "[u'Mailbox with this Name already exists.']"
+)
+
+
+def parse_eagerly(fault):
+    exc_type, exc_message = fault.faultString.split(':', 1)
+    message = ast.literal_eval(exc_message)
+    return exc_type, message[0] if message else None
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    faults = [xmlrpc_client.Fault(1, COLLISION) for _ in range(count)]
+
+    cases = (
+        ('eager', lambda: [parse_eagerly(f) for f in faults]),
+        ('lazy, type', lambda: [
+            WebFactionFault(f).exception_type for f in faults
+        ]),
+        ('lazy, message', lambda: [
+            WebFactionFault(f).exception_message for f in faults
+        ]),
+    )
+
+    print("%d faults" % count)
+
+    for name, function in cases:
+        best = min(timeit.repeat(function, number=1, repeat=5))
+        print("%-14s %8.1f ms" % (name, best * 1000))
+
+
+if __name__ == '__main__':
+    main()
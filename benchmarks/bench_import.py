@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+"""Measures how long the command-line tool takes to start, using
+``python -X importtime``.
+
+Exits with an error if importing ``pywebfaction.cli`` takes longer
+than the budget (in milliseconds, 50 by default), or if it imports any
+of the modules only individual commands need.
+
+Usage: python benchmarks/bench_import.py [budget]
+"""
+from __future__ import print_function
+
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules which should only be imported by the commands that use them.
+LAZY_MODULES = (
+    'docopt',
+    'pywebfaction.api',
+    'six.moves.configparser',
+    'tabulate',
+    'xmlrpc.client',
+)
+
+
+def import_times(module='pywebfaction.cli'):
+    """Returns a dictionary mapping each module imported by
+    ``module`` to its cumulative import time in microseconds.
+    """
+    output = subprocess.check_output(
+        [sys.executable, '-X', 'importtime', '-c', 'import %s' % module],
+        cwd=ROOT,
+        stderr=subprocess.STDOUT,
+    ).decode('utf-8')
+    times = {}
+
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+
+        _, cumulative, name = line.split('|')
+        times[name.strip()] = int(cumulative)
+
+    return times
+
+
+def help_time():
+    start = time.time()
+    subprocess.check_output(
+        [sys.executable, '-m', 'pywebfaction.cli', '--help'],
+        cwd=ROOT,
+    )
+    return time.time() - start
+
+
+def main():
+    budget = float(sys.argv[1]) if len(sys.argv) > 1 else 50.0
+    runs = [import_times() for _ in range(5)]
+    best = min(times['pywebfaction.cli'] for times in runs) / 1000.0
+    heavy = sorted(set(LAZY_MODULES) & set(runs[0]))
+
+    print("import pywebfaction.cli  %8.1f ms (budget %.1f ms)"
+          % (best, budget))
+    print("pywebfaction --help      %8.1f ms"
+          % (min(help_time() for _ in range(5)) * 1000))
+
+    if heavy:
+        print("imported eagerly: %s" % ', '.join(heavy))
+
+    if heavy or best > budget:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
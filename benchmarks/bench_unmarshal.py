@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+"""Compares parsing a large list_emails response with the standard
+library's unmarshaller against pywebfaction's own parser.
+
+Usage: python benchmarks/bench_unmarshal.py [entries]
+"""
+from __future__ import print_function
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+
+from pywebfaction.streaming import parse_email_response  # noqa
+from pywebfaction.utils import Email  # noqa
+from six.moves import xmlrpc_client  # noqa
+
+
+def make_response(entries):
+    return xmlrpc_client.dumps(
+        (
+            [
+                {
+                    'id': i,
+                    'email_address': 'user%d@example.com' % i,
+                    'targets': 'user%d_examplecom,forward%d@example.org' % (
+                        i, i % 100
+                    ),
+                }
+                for i in range(entries)
+            ],
+        ),
+        methodresponse=True,
+    ).encode('utf-8')
+
+
+def parse_with_stdlib(data):
+    return [Email(entry) for entry in xmlrpc_client.loads(data)[0][0]]
+
+
+def main():
+    entries = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    data = make_response(entries)
+
+    assert parse_with_stdlib(data) == parse_email_response(data)
+
+    print("%d entries, %d bytes" % (entries, len(data)))
+
+    for name, function in (('stdlib', parse_with_stdlib),
+                           ('pywebfaction', parse_email_response)):
+        best = min(timeit.repeat(lambda: function(data),
+                                 number=1, repeat=5))
+        print("%-14s %8.1f ms" % (name, best * 1000))
+
+
+if __name__ == '__main__':
+    main()
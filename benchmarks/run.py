@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+"""End-to-end benchmarks for WebFactionAPI against a local fake
+server.
+
+Usage: python benchmarks/run.py [--latency=SECONDS] [--jitter=SECONDS]
+                                [--emails=N] [--iterations=N]
+                                [--workers=N]
+
+Reports latency percentiles and throughput for each client method,
+and for bulk operations.
+"""
+from __future__ import print_function
+
+import argparse
+import itertools
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+
+from pywebfaction.testing import FakeWebFactionServer, sample_emails  # noqa
+from pywebfaction import WebFactionAPI  # noqa
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def report(name, samples, operations=None):
+    total = sum(samples)
+    if operations is None:
+        operations = len(samples)
+
+    print("%-28s %8.2f %8.2f %8.2f %8.2f %10.1f" % (
+        name,
+        percentile(samples, 0.5) * 1000,
+        percentile(samples, 0.9) * 1000,
+        percentile(samples, 0.99) * 1000,
+        max(samples) * 1000,
+        operations / total if total else float('inf'),
+    ))
+
+
+def timed(function, iterations):
+    samples = []
+
+    for _ in range(iterations):
+        start = time.time()
+        function()
+        samples.append(time.time() - start)
+
+    return samples
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="seconds of delay added to every call")
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help="up to this many more seconds of random delay")
+    parser.add_argument('--emails', type=int, default=1000,
+                        help="size of the list_emails response")
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--bulk', type=int, default=500,
+                        help="number of addresses for bulk scenarios")
+    options = parser.parse_args(argv)
+
+    server = FakeWebFactionServer(latency=options.latency,
+                                  jitter=options.jitter,
+                                  emails=sample_emails(options.emails)).start()
+    endpoint = server.endpoint
+    counter = itertools.count()
+
+    def address():
+        return 'bench%d@example.net' % next(counter)
+
+    try:
+        print("%-28s %8s %8s %8s %8s %10s" % (
+            "scenario (ms, ops/s)", "p50", "p90", "p99", "max", "ops/s"
+        ))
+
+        report('login', timed(
+            lambda: WebFactionAPI('user', 'password', endpoint=endpoint),
+            options.iterations
+        ))
+
+        api = WebFactionAPI('user', 'password', endpoint=endpoint)
+
+        report('list_emails (%d)' % options.emails, timed(
+            api.list_emails, options.iterations
+        ))
+        report('iter_emails (%d)' % options.emails, timed(
+            lambda: sum(1 for _ in api.iter_emails()), options.iterations
+        ))
+        report('create_email', timed(
+            lambda: api.create_email(address()), options.iterations
+        ))
+        report('create_email_forwarder', timed(
+            lambda: api.create_email_forwarder(
+                address(), ['me@example.org']
+            ),
+            options.iterations
+        ))
+
+        addresses = [address() for _ in range(options.bulk)]
+        start = time.time()
+        for address_, result in api.create_emails(
+                addresses, max_workers=options.workers):
+            assert not isinstance(result, Exception), result
+        report('create_emails x%d' % options.bulk,
+               [time.time() - start], options.bulk)
+
+        addresses = [address() for _ in range(options.bulk)]
+        start = time.time()
+        with api.batch() as batch:
+            for address_ in addresses:
+                batch.create_email_forwarder(address_, ['me@example.org'])
+        report('batch forwarders x%d' % options.bulk,
+               [time.time() - start], options.bulk)
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
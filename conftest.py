@@ -0,0 +1,9 @@
+import sys
+
+
+# The asyncio client and its tests use syntax (and asyncio.run) which
+# older Pythons don't have.
+collect_ignore = []
+
+if sys.version_info < (3, 7):
+    collect_ignore.append('test_aio.py')
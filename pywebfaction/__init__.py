@@ -1,84 +1,55 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-from pywebfaction.exceptions import WebFactionFault
-from pywebfaction.mailbox_name import email_to_mailbox_name
-from pywebfaction.utils import Email, EmailRequestResponse
-from six.moves import xmlrpc_client
-
-
-WEBFACTION_API_ENDPOINT = 'https://api.webfaction.com/'
-
-
-class WebFactionAPI(object):
-    def __init__(self, user, password):
-        self.username = user
-        self.server = xmlrpc_client.Server(WEBFACTION_API_ENDPOINT)
-        try:
-            self.session_id, _ = self.server.login(self.username, password)
-        except xmlrpc_client.Fault as e:
-            raise WebFactionFault(e)
-
-    def list_emails(self):
-        try:
-            response = self.server.list_emails(self.session_id)
-
-            return [Email(r) for r in response]
-        except xmlrpc_client.Fault as e:
-            raise WebFactionFault(e)
-
-    def create_email(self, email_address):
-        # Mailbox names may only contain lowercase letters, numbers
-        # and _.
-        mailbox_base = email_to_mailbox_name(email_address)
-        mailbox = mailbox_base
-        suffix = None
-
-        while True:
-            try:
-                mailbox_result = self.server.create_mailbox(
-                    self.session_id,
-                    mailbox
-                )
-                break
-            except xmlrpc_client.Fault as e:
-                if not suffix:
-                    suffix = 1
-                else:
-                    suffix += 1
-
-                if suffix > 10:
-                    raise WebFactionFault(e)
-
-                mailbox = '%s%d' % (mailbox_base, suffix)
-
-        try:
-            email_result = self.server.create_email(
-                self.session_id,
-                email_address,
-                mailbox
+import sys
+
+
+__all__ = [
+    'Email',
+    'EmailRequestResponse',
+    'WEBFACTION_API_ENDPOINT',
+    'WebFactionAPI',
+    'WebFactionFault',
+    'email_to_mailbox_name',
+    'email_to_mailbox_names',
+]
+
+# Where each public name lives. Importing the API client pulls in the
+# XML-RPC, HTTP and threading machinery, so the names are only imported
+# when they're first used - which keeps things like ``pywebfaction
+# --help`` quick.
+_EXPORTS = {
+    'Email': 'pywebfaction.utils',
+    'EmailRequestResponse': 'pywebfaction.utils',
+    'SESSION_FAULT_TYPES': 'pywebfaction.api',
+    'WEBFACTION_API_ENDPOINT': 'pywebfaction.api',
+    'WebFactionAPI': 'pywebfaction.api',
+    'WebFactionFault': 'pywebfaction.exceptions',
+    'email_to_mailbox_name': 'pywebfaction.mailbox_name',
+    'email_to_mailbox_names': 'pywebfaction.mailbox_name',
+}
+
+
+def _load(name):
+    module = __import__(_EXPORTS[name], fromlist=[name])
+    value = getattr(module, name)
+    globals()[name] = value
+    return value
+
+
+if sys.version_info >= (3, 7):
+    def __getattr__(name):
+        if name not in _EXPORTS:
+            raise AttributeError(
+                "module %r has no attribute %r" % (__name__, name)
             )
 
-            return EmailRequestResponse(
-                mailbox,
-                mailbox_result['password'],
-                email_result['id'],
-            )
-        except xmlrpc_client.Fault as email_creation_failure:
-            try:
-                self.server.delete_mailbox(self.session_id, mailbox)
-            except xmlrpc_client.Fault:
-                raise WebFactionFault(email_creation_failure)
-            raise WebFactionFault(email_creation_failure)
-
-    def create_email_forwarder(self, email_address, forwarding_addresses):
-        try:
-            result = self.server.create_email(
-                self.session_id,
-                email_address,
-                ','.join(forwarding_addresses)
-            )
+        return _load(name)
 
-            return result['id']
-        except xmlrpc_client.Fault as e:
-            raise WebFactionFault(e)
+    def __dir__():
+        return sorted(set(globals()) | set(_EXPORTS))
+else:
+    # Modules can't have __getattr__ before Python 3.7, so import
+    # everything up front.
+    for _name in _EXPORTS:
+        _load(_name)
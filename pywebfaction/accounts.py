@@ -0,0 +1,127 @@
+from pywebfaction.api import WebFactionAPI
+from pywebfaction.bulk import DEFAULT_MAX_WORKERS, run_concurrently
+from six.moves import configparser
+
+
+def _capture(function):
+    # Wraps ``function`` so that any error is returned rather than
+    # raised, so that one account failing doesn't stop the others.
+    def wrapper(item):
+        try:
+            return function(item)
+        except Exception as e:
+            return e
+
+    return wrapper
+
+
+class WebFactionAccounts(object):
+    """Manages a ``WebFactionAPI`` for each of several accounts, and
+    calls methods on all of them at once.
+
+    ``credentials`` maps a name for each account to a ``(username,
+    password)`` pair. Any other keyword arguments are passed on to
+    each ``WebFactionAPI``. At most ``max_workers`` accounts are
+    talked to at once.
+
+    Accounts which fail to log in, or whose call fails, are left out
+    of the results, and their errors collected in ``errors``, which
+    maps account names to exceptions.
+    """
+
+    def __init__(self, credentials, max_workers=DEFAULT_MAX_WORKERS,
+                 **api_kwargs):
+        self.credentials = dict(credentials)
+        self.max_workers = max_workers
+        self.api_kwargs = api_kwargs
+        self.apis = {}
+        self.errors = {}
+
+    @classmethod
+    def from_config(cls, filename, **kwargs):
+        """Reads the accounts from an ini file. Every section with a
+        ``username`` and ``password`` is an account, named after the
+        section.
+        """
+        config = configparser.RawConfigParser()
+        config.read(filename)
+
+        credentials = dict(
+            (section, (config.get(section, 'username'),
+                       config.get(section, 'password')))
+            for section in config.sections()
+            if config.has_option(section, 'username') and
+            config.has_option(section, 'password')
+        )
+
+        return cls(credentials, **kwargs)
+
+    @property
+    def names(self):
+        return sorted(self.credentials)
+
+    def _fan_out(self, function, names):
+        return run_concurrently(
+            _capture(function),
+            names,
+            max_workers=self.max_workers
+        )
+
+    def login(self):
+        """Logs in to every account which isn't logged in yet, all at
+        once.
+        """
+        def connect(name):
+            username, password = self.credentials[name]
+            return WebFactionAPI(username, password, **self.api_kwargs)
+
+        names = [name for name in self.names if name not in self.apis]
+
+        for name, result in self._fan_out(connect, names):
+            if isinstance(result, Exception):
+                self.errors[name] = result
+            else:
+                self.errors.pop(name, None)
+                self.apis[name] = result
+
+    def iter_call(self, method, *args, **kwargs):
+        """Calls ``method`` with the given arguments on every account
+        at once, logging in first if need be. Yields ``(account,
+        result)`` pairs as each call finishes, where ``result`` is the
+        exception raised if the call failed.
+        """
+        self.login()
+
+        def call(name):
+            return getattr(self.apis[name], method)(*args, **kwargs)
+
+        for name, result in self._fan_out(call, sorted(self.apis)):
+            if isinstance(result, Exception):
+                self.errors[name] = result
+
+            yield name, result
+
+    def call(self, method, *args, **kwargs):
+        """Like ``iter_call``, but waits for every account, and returns
+        a dictionary mapping account names to results. Failed accounts
+        are left out, and their errors put in ``errors``.
+        """
+        self.errors = {}
+
+        return dict(
+            (name, result)
+            for name, result in self.iter_call(method, *args, **kwargs)
+            if not isinstance(result, Exception)
+        )
+
+    def list_emails(self):
+        """Returns ``(account, email)`` pairs for every email address
+        in every account, ordered by account and then address.
+        """
+        results = self.call('list_emails')
+
+        return [
+            (name, email)
+            for name in sorted(results)
+            for email in sorted(results[name], key=lambda e: e.address)
+        ]
@@ -0,0 +1,371 @@
+"""An asyncio version of the WebFaction API client.
+
+This module needs Python 3.5 or later, so it isn't imported by
+``pywebfaction`` itself - import ``AsyncWebFactionAPI`` from here.
+"""
+import asyncio
+import ssl
+
+from six.moves import xmlrpc_client
+from six.moves.urllib.parse import urlsplit
+
+from pywebfaction.api import (
+    SESSION_FAULT_TYPES,
+    WEBFACTION_API_ENDPOINT,
+)
+from pywebfaction.exceptions import WebFactionFault
+from pywebfaction.mailbox_name import email_to_mailbox_name
+from pywebfaction.retry import request_sent
+from pywebfaction.utils import Email, EmailRequestResponse
+
+
+DEFAULT_CONCURRENCY = 20
+
+
+class AsyncTransport(object):
+    """Sends XML-RPC requests over non-blocking HTTP/1.1 connections.
+
+    At most ``limit`` requests are in flight at once. Connections are
+    kept alive and reused between requests, and a reused connection
+    which the server has closed is replaced transparently.
+    """
+
+    user_agent = xmlrpc_client.Transport.user_agent
+
+    def __init__(self, endpoint, limit=DEFAULT_CONCURRENCY,
+                 ssl_context=None):
+        parts = urlsplit(endpoint)
+        self.use_https = parts.scheme == 'https'
+        self.host = parts.hostname
+        self.port = parts.port or (443 if self.use_https else 80)
+        self.netloc = parts.netloc
+        self.handler = parts.path or '/'
+        self.limit = limit
+
+        if self.use_https and ssl_context is None:
+            ssl_context = ssl.create_default_context()
+
+        self.ssl_context = ssl_context
+        self._semaphore = None
+        self._idle = []
+
+    def _get_semaphore(self):
+        # Created lazily so that the transport can be built outside of
+        # a running event loop.
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.limit)
+        return self._semaphore
+
+    async def _connect(self):
+        return await asyncio.open_connection(
+            self.host,
+            self.port,
+            ssl=self.ssl_context if self.use_https else None,
+        )
+
+    async def _send(self, connection, request_body):
+        reader, writer = connection
+
+        writer.write((
+            'POST %s HTTP/1.1\r\n'
+            'Host: %s\r\n'
+            'User-Agent: %s\r\n'
+            'Content-Type: text/xml\r\n'
+            'Content-Length: %d\r\n'
+            '\r\n' % (
+                self.handler,
+                self.netloc,
+                self.user_agent,
+                len(request_body),
+            )
+        ).encode('latin-1') + request_body)
+        await writer.drain()
+
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError('Connection closed by server')
+
+        parts = status_line.decode('latin-1').split(None, 2)
+        version = parts[0].upper()
+        status = parts[1]
+        reason = parts[2] if len(parts) > 2 else ''
+        headers = {}
+
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, value = line.decode('latin-1').split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+
+        connection = headers.get('connection', '').lower()
+        # HTTP/1.0 connections close after each response unless the
+        # server says otherwise.
+        will_close = connection == 'close' or (
+            version == 'HTTP/1.0' and connection != 'keep-alive'
+        )
+
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            body = await self._read_chunked(reader)
+        elif 'content-length' in headers:
+            body = await reader.readexactly(int(headers['content-length']))
+        else:
+            will_close = True
+            body = await reader.read()
+
+        return int(status), reason.strip(), headers, body, will_close
+
+    async def _read_chunked(self, reader):
+        chunks = []
+
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            if not size:
+                break
+            chunks.append(await reader.readexactly(size))
+            await reader.readline()
+
+        # Skip any trailers.
+        while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+            pass
+
+        return b''.join(chunks)
+
+    async def request(self, request_body):
+        # Errors (and cancellations) which happen before the request
+        # is written are marked, so callers know it's safe to retry or
+        # roll back whatever the request would have done.
+        sent = False
+
+        try:
+            async with self._get_semaphore():
+                reused = bool(self._idle)
+                connection = (self._idle.pop() if reused
+                              else await self._connect())
+
+                try:
+                    # _send writes the request before it first waits.
+                    sent = True
+                    response = await self._send(connection, request_body)
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    connection[1].close()
+                    if not reused:
+                        raise
+                    connection = await self._connect()
+                    response = await self._send(connection, request_body)
+                except BaseException:
+                    connection[1].close()
+                    raise
+        except BaseException as e:
+            if not sent:
+                e.request_sent = False
+            raise
+
+        status, reason, headers, body, will_close = response
+
+        if will_close:
+            connection[1].close()
+        else:
+            self._idle.append(connection)
+
+        if status != 200:
+            raise xmlrpc_client.ProtocolError(
+                self.netloc + self.handler,
+                status,
+                reason,
+                headers,
+            )
+
+        return body
+
+    def close(self):
+        idle, self._idle = self._idle, []
+
+        for _, writer in idle:
+            writer.close()
+
+
+class AsyncWebFactionAPI(object):
+    """A coroutine-based equivalent of ``WebFactionAPI``.
+
+    Since logging in needs the event loop, it doesn't happen in the
+    constructor - either ``await api.login()``, or use the API as an
+    asynchronous context manager.
+
+    ``timeout`` limits how long each method may take in total; methods
+    also take a ``timeout`` of their own. When a method times out (or
+    is cancelled), ``asyncio.TimeoutError`` (or ``CancelledError``) is
+    raised as usual, after any clean-up it needs has been done.
+    """
+
+    def __init__(self, user, password, endpoint=WEBFACTION_API_ENDPOINT,
+                 transport=None, concurrency=DEFAULT_CONCURRENCY,
+                 timeout=None):
+        if transport is None:
+            transport = AsyncTransport(endpoint, limit=concurrency)
+
+        self.username = user
+        self.transport = transport
+        self.timeout = timeout
+        self.session_id = None
+        self._password = password
+        self._login_lock = None
+
+    async def __aenter__(self):
+        if self.session_id is None:
+            await self.login()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.transport.close()
+
+    async def _with_timeout(self, coroutine, timeout):
+        if timeout is None:
+            timeout = self.timeout
+
+        if timeout is None:
+            return await coroutine
+
+        return await asyncio.wait_for(coroutine, timeout)
+
+    async def _request(self, method, *params):
+        body = xmlrpc_client.dumps(params, method).encode('utf-8')
+        response = await self.transport.request(body)
+        return xmlrpc_client.loads(response)[0][0]
+
+    async def login(self, timeout=None):
+        try:
+            self.session_id, _ = await self._with_timeout(
+                self._request('login', self.username, self._password),
+                timeout
+            )
+        except xmlrpc_client.Fault as e:
+            raise WebFactionFault(e)
+
+    async def _session_expired(self, session_id):
+        # Created lazily, like the transport's semaphore.
+        if self._login_lock is None:
+            self._login_lock = asyncio.Lock()
+
+        async with self._login_lock:
+            # Another call may already have logged in again.
+            if self.session_id == session_id:
+                await self.login()
+
+    async def _call(self, method, *args):
+        session_id = self.session_id
+
+        try:
+            return await self._request(method, session_id, *args)
+        except xmlrpc_client.Fault as e:
+            if WebFactionFault(e).exception_type not in SESSION_FAULT_TYPES:
+                raise
+
+        await self._session_expired(session_id)
+        return await self._request(method, self.session_id, *args)
+
+    async def list_emails(self, timeout=None):
+        try:
+            response = await self._with_timeout(
+                self._call('list_emails'),
+                timeout
+            )
+
+            return [Email(r) for r in response]
+        except xmlrpc_client.Fault as e:
+            raise WebFactionFault(e)
+
+    async def create_email(self, email_address, timeout=None):
+        return await self._with_timeout(
+            self._create_email(email_address),
+            timeout
+        )
+
+    async def _create_email(self, email_address):
+        mailbox_base = email_to_mailbox_name(email_address)
+        mailbox = mailbox_base
+        suffix = None
+
+        while True:
+            try:
+                mailbox_result = await self._call('create_mailbox', mailbox)
+                break
+            except xmlrpc_client.Fault as e:
+                if not suffix:
+                    suffix = 1
+                else:
+                    suffix += 1
+
+                if suffix > 10:
+                    raise WebFactionFault(e)
+
+                mailbox = '%s%d' % (mailbox_base, suffix)
+
+        try:
+            email_result = await self._call(
+                'create_email',
+                email_address,
+                mailbox
+            )
+        except BaseException as e:
+            # Don't leave the mailbox behind, even if we were cancelled
+            # (e.g. by a timeout) - unless the email may have been
+            # created first, as it would then deliver to a mailbox which
+            # no longer exists. The clean-up is shielded so that
+            # cancelling us again doesn't interrupt it.
+            try:
+                await asyncio.shield(
+                    self._roll_back(e, email_address, mailbox)
+                )
+            except asyncio.CancelledError:
+                pass
+
+            if isinstance(e, xmlrpc_client.Fault):
+                raise WebFactionFault(e)
+            raise
+
+        return EmailRequestResponse(
+            mailbox,
+            mailbox_result['password'],
+            email_result['id'],
+        )
+
+    async def _roll_back(self, error, email_address, mailbox):
+        if (isinstance(error, xmlrpc_client.Fault) or
+                not request_sent(error) or
+                await self._email_exists(email_address) is False):
+            await self._delete_mailbox(mailbox)
+
+    async def _email_exists(self, email_address):
+        # Returns whether WebFaction has ``email_address``, or None if
+        # we can't find out.
+        try:
+            emails = await self._call('list_emails')
+        except Exception:
+            return None
+
+        return any(e['email_address'] == email_address for e in emails)
+
+    async def _delete_mailbox(self, mailbox):
+        # Failures are ignored, since the caller is already dealing
+        # with a more useful error.
+        try:
+            await self._call('delete_mailbox', mailbox)
+        except Exception:
+            pass
+
+    async def create_email_forwarder(self, email_address,
+                                     forwarding_addresses, timeout=None):
+        try:
+            result = await self._with_timeout(
+                self._call(
+                    'create_email',
+                    email_address,
+                    ','.join(forwarding_addresses)
+                ),
+                timeout
+            )
+
+            return result['id']
+        except xmlrpc_client.Fault as e:
+            raise WebFactionFault(e)
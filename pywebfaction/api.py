@@ -0,0 +1,725 @@
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import six
+
+from pywebfaction.batch import Batch
+from pywebfaction.bulk import DEFAULT_MAX_WORKERS, run_concurrently
+from pywebfaction.exceptions import WebFactionFault
+from pywebfaction.mailbox_name import (
+    MAX_MAILBOX_SUFFIX,
+    email_to_mailbox_name,
+    mailbox_name_candidates,
+)
+from pywebfaction.metrics import CallEvent
+from pywebfaction.reconcile import apply_changes, parse_desired_state, plan
+from pywebfaction.retry import RetryPolicy, request_sent
+from pywebfaction.streaming import iter_email_response
+from pywebfaction.throttle import wait_timeout
+from pywebfaction.transport import PooledTransport
+from pywebfaction.utils import Email, EmailRequestResponse
+from pywebfaction.watch import Watcher
+from six.moves import xmlrpc_client
+from six.moves.urllib.parse import urlsplit
+
+
+WEBFACTION_API_ENDPOINT = 'https://api.webfaction.com/'
+
+DEFAULT_CONNECT_TIMEOUT = 10.0
+DEFAULT_READ_TIMEOUT = 60.0
+
+# Fault types WebFaction uses when it no longer recognises a session.
+SESSION_FAULT_TYPES = ('LoginError', 'SessionError')
+
+
+class WebFactionAPI(object):
+    def __init__(self, user, password, endpoint=WEBFACTION_API_ENDPOINT,
+                 transport=None, session_cache=None, observers=(),
+                 retry_policy=None, connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+                 read_timeout=DEFAULT_READ_TIMEOUT, rate_limiter=None,
+                 concurrency=None):
+        if transport is None:
+            transport = PooledTransport(
+                use_https=urlsplit(endpoint).scheme == 'https'
+            )
+
+        parts = urlsplit(endpoint)
+        self.username = user
+        self.transport = transport
+        self._host = parts.netloc
+        self._handler = parts.path or '/RPC2'
+        self.session_cache = session_cache
+        self.observers = list(observers)
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.rate_limiter = rate_limiter
+        self.concurrency = concurrency
+        self.server = xmlrpc_client.Server(endpoint, transport=transport)
+        self.supports_multicall = True
+        self._password = password
+        self._login_lock = threading.Lock()
+        self._mailbox_names = None
+        self._reserved_mailbox_names = set()
+        self._mailbox_names_lock = threading.Lock()
+        self._local = threading.local()
+
+        self.session_id = None
+        if session_cache is not None:
+            self.session_id = session_cache.get(user)
+
+        if self.session_id is None:
+            self.login()
+
+    def add_observer(self, observer):
+        """Registers a callable to be given a ``CallEvent`` after every
+        XML-RPC request the API makes.
+        """
+        self.observers.append(observer)
+
+    def _notify(self, method, start, request_bytes, response_bytes,
+                retries, error):
+        if not self.observers:
+            return
+
+        fault_type = None
+        if isinstance(error, xmlrpc_client.Fault):
+            fault_type = WebFactionFault(error).exception_type
+            error = None
+
+        event = CallEvent(
+            method,
+            time.time() - start,
+            request_bytes=request_bytes,
+            response_bytes=response_bytes,
+            retries=retries,
+            fault_type=fault_type,
+            error=error,
+        )
+
+        for observer in self.observers:
+            observer(event)
+
+    def _marshal(self, method, params):
+        return xmlrpc_client.dumps(params, method, allow_none=True).encode(
+            'utf-8',
+            'xmlcharrefreplace'
+        )
+
+    @contextmanager
+    def _timeouts(self, expires=None):
+        # Applies the API's timeouts to requests made inside the block,
+        # shortened so that they can't run past ``expires``.
+        connect, read = self.connect_timeout, self.read_timeout
+
+        if expires is not None:
+            remaining = expires - time.time()
+
+            if remaining <= 0:
+                raise wait_timeout()
+
+            connect = remaining if connect is None else min(connect, remaining)
+            read = remaining if read is None else min(read, remaining)
+
+        if not hasattr(self.transport, 'timeouts'):
+            yield
+            return
+
+        with self.transport.timeouts(connect, read):
+            yield
+
+    @contextmanager
+    def _throttle(self, method, expires=None):
+        # Waits until the rate limiter and concurrency controller (if
+        # any) allow a call to ``method``, and tells the controller how
+        # it went. Gives up with socket.timeout if that can't happen
+        # before ``expires``.
+        def remaining():
+            if expires is None:
+                return None
+            return expires - time.time()
+
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire(method, remaining())
+
+        if self.concurrency is None:
+            yield
+            return
+
+        ticket = self.concurrency.acquire(remaining())
+        start = time.time()
+        overloaded = False
+
+        try:
+            yield
+        except Exception as e:
+            # Anything worth retrying (network errors, 5xx responses,
+            # server-side faults) suggests the server is struggling.
+            overloaded = self.retry_policy.is_retryable(e)
+            raise
+        finally:
+            self.concurrency.release(
+                ticket,
+                time.time() - start,
+                overloaded,
+                method
+            )
+
+    def _request(self, method, params, retries=0, expires=None):
+        # Makes a single XML-RPC request, reporting it to any
+        # observers.
+        body = self._marshal(method, params)
+        start = time.time()
+        error = None
+
+        try:
+            with self._throttle(method, expires), self._timeouts(expires):
+                response = self.transport.request(
+                    self._host,
+                    self._handler,
+                    body
+                )
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self._notify(
+                method,
+                start,
+                getattr(self.transport, 'last_request_size', len(body)),
+                getattr(self.transport, 'last_response_size', None),
+                retries,
+                error,
+            )
+
+        if len(response) == 1:
+            return response[0]
+
+        return response
+
+    def _new_deadline(self, timeout=None):
+        # A deadline is a (retry deadline, expiry time) pair. Retries
+        # stop at the retry deadline, which comes from the retry
+        # policy, while nothing at all may run past the expiry time,
+        # which comes from the ``timeout`` given for the operation.
+        expires = None
+        if timeout is not None:
+            expires = time.time() + timeout
+
+        return (self.retry_policy.start(), expires)
+
+    @contextmanager
+    def _operation(self, timeout=None):
+        # Everything done inside an operation shares one deadline.
+        # Nested operations use the outermost deadline.
+        if getattr(self._local, 'deadline', None) is not None:
+            yield
+            return
+
+        self._local.deadline = self._new_deadline(timeout)
+        try:
+            yield
+        finally:
+            self._local.deadline = None
+
+    @contextmanager
+    def _cleanup(self):
+        # Gives clean-up work a deadline of its own, since it often
+        # runs because the operation's deadline has passed.
+        deadline = getattr(self._local, 'deadline', None)
+        self._local.deadline = self._new_deadline()
+
+        try:
+            yield
+        finally:
+            self._local.deadline = deadline
+
+    def _deadline(self):
+        deadline = getattr(self._local, 'deadline', None)
+
+        if deadline is None:
+            return self._new_deadline()
+
+        return deadline
+
+    def _prepare_retry(self, method, error, attempt, deadline, session_id):
+        # Gets ready to try a failed call again, either by logging in
+        # again (if the server rejected ``session_id``) or by backing
+        # off. Returns None if the call shouldn't be tried again.
+        retry_deadline, expires = deadline
+
+        if expires is not None and time.time() >= expires:
+            return None
+
+        if session_id is not None and self._is_session_fault(error):
+            self._session_expired(session_id)
+            return 'login'
+
+        delay = self.retry_policy.delay(
+            error,
+            attempt + 1,
+            retry_deadline,
+            method
+        )
+
+        if delay is None:
+            return None
+
+        if expires is not None and time.time() + delay >= expires:
+            return None
+
+        self.retry_policy.sleep(delay)
+        return 'backoff'
+
+    def _request_with_retries(self, method, args, with_session=True):
+        # Makes a request, retrying as the retry policy allows. When
+        # the request takes a session, a rejected session causes one
+        # extra attempt after logging in again.
+        deadline = self._deadline()
+        attempt = 0
+        may_log_in_again = with_session
+
+        while True:
+            session_id = self.session_id
+            params = (session_id, ) + args if with_session else args
+
+            try:
+                return self._request(
+                    method,
+                    params,
+                    retries=attempt,
+                    expires=deadline[1]
+                )
+            except Exception as e:
+                action = self._prepare_retry(
+                    method,
+                    e,
+                    attempt,
+                    deadline,
+                    session_id if may_log_in_again else None
+                )
+
+                if action is None:
+                    raise
+
+                if action == 'login':
+                    may_log_in_again = False
+
+            attempt += 1
+
+    def login(self, timeout=None):
+        with self._operation(timeout):
+            try:
+                self.session_id, _ = self._request_with_retries(
+                    'login',
+                    (self.username, self._password),
+                    with_session=False
+                )
+            except xmlrpc_client.Fault as e:
+                raise WebFactionFault(e)
+
+        if self.session_cache is not None:
+            self.session_cache.set(self.username, self.session_id)
+
+    def _is_session_fault(self, fault):
+        if not isinstance(fault, xmlrpc_client.Fault):
+            return False
+
+        return WebFactionFault(fault).exception_type in SESSION_FAULT_TYPES
+
+    def _session_expired(self, session_id):
+        with self._login_lock:
+            # Another thread may already have logged in again.
+            if self.session_id != session_id:
+                return
+
+            if self.session_cache is not None:
+                self.session_cache.clear(self.username)
+
+            self.login()
+
+    def _call(self, method, *args):
+        # Calls an API method with the current session. Failures are
+        # raised as xmlrpc_client.Fault.
+        return self._request_with_retries(method, args)
+
+    def batch(self, chunk_size=None):
+        if chunk_size is None:
+            return Batch(self)
+
+        return Batch(self, chunk_size=chunk_size)
+
+    def list_emails(self, timeout=None):
+        with self._operation(timeout):
+            if hasattr(self.transport, 'stream_request'):
+                return list(self.iter_emails())
+
+            try:
+                response = self._call('list_emails')
+
+                return [Email(r) for r in response]
+            except xmlrpc_client.Fault as e:
+                raise WebFactionFault(e)
+
+    def list_mailboxes(self, timeout=None):
+        """Returns the names of the account's mailboxes."""
+        with self._operation(timeout):
+            try:
+                names = set(m['mailbox'] for m in self._call('list_mailboxes'))
+            except xmlrpc_client.Fault as e:
+                raise WebFactionFault(e)
+
+        with self._mailbox_names_lock:
+            self._mailbox_names = names | self._reserved_mailbox_names
+
+        return sorted(names)
+
+    def _load_mailbox_names(self, refresh=False):
+        # Lists the account's mailboxes, if we haven't yet (or
+        # ``refresh`` is true). Names reserved by calls in progress are
+        # kept, since WebFaction may not have them yet.
+        with self._mailbox_names_lock:
+            if self._mailbox_names is None or refresh:
+                self._mailbox_names = set(
+                    m['mailbox'] for m in self._call('list_mailboxes')
+                ) | self._reserved_mailbox_names
+
+    def _reserve_mailbox_name(self, candidates):
+        # Picks the first candidate not known to be taken, and marks
+        # it as taken so that concurrent calls don't pick it too.
+        with self._mailbox_names_lock:
+            for candidate in candidates:
+                if candidate not in self._mailbox_names:
+                    self._mailbox_names.add(candidate)
+                    self._reserved_mailbox_names.add(candidate)
+                    return candidate
+
+        return None
+
+    def _settle_mailbox_name(self, mailbox):
+        # The call which reserved ``mailbox`` has found out whether it
+        # could create it.
+        with self._mailbox_names_lock:
+            self._reserved_mailbox_names.discard(mailbox)
+
+    def _release_mailbox_name(self, mailbox):
+        with self._mailbox_names_lock:
+            self._mailbox_names.discard(mailbox)
+
+    def _stream_request(self, method, params, parse, retries=0,
+                        expires=None):
+        # Like _request, but hands the response body to ``parse`` as it
+        # arrives, and yields whatever that produces.
+        body = self._marshal(method, params)
+        start = time.time()
+        response_bytes = [0]
+        error = None
+
+        def chunks():
+            # Only sending the request and waiting for the response to
+            # start is throttled, so that a slow consumer doesn't hold
+            # up other calls.
+            with self._throttle(method, expires), self._timeouts(expires):
+                stream = self.transport.stream_request(
+                    self._host,
+                    self._handler,
+                    body
+                )
+
+            for chunk in stream:
+                response_bytes[0] += len(chunk)
+                yield chunk
+
+        try:
+            for item in parse(chunks()):
+                yield item
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self._notify(
+                method,
+                start,
+                getattr(self.transport, 'last_request_size', len(body)),
+                getattr(
+                    self.transport,
+                    'last_response_size',
+                    response_bytes[0]
+                ),
+                retries,
+                error,
+            )
+
+    def iter_emails(self, timeout=None):
+        """Yields the account's email addresses one at a time.
+
+        This is equivalent to ``list_emails``, but parses the response
+        as it arrives rather than building the whole list in memory.
+        """
+        if not hasattr(self.transport, 'stream_request'):
+            try:
+                with self._operation(timeout):
+                    response = self._call('list_emails')
+            except xmlrpc_client.Fault as e:
+                raise WebFactionFault(e)
+
+            for entry in response:
+                yield Email(entry)
+            return
+
+        if timeout is None:
+            deadline = self._deadline()
+        else:
+            deadline = self._new_deadline(timeout)
+        attempt = 0
+        may_log_in_again = True
+
+        while True:
+            session_id = self.session_id
+            started = False
+
+            try:
+                for email in self._stream_request(
+                    'list_emails',
+                    (session_id, ),
+                    iter_email_response,
+                    retries=attempt,
+                    expires=deadline[1]
+                ):
+                    started = True
+                    yield email
+                return
+            except Exception as e:
+                # Once we've started yielding emails, trying again
+                # would give the caller duplicates.
+                action = None
+                if not started:
+                    action = self._prepare_retry(
+                        'list_emails',
+                        e,
+                        attempt,
+                        deadline,
+                        session_id if may_log_in_again else None
+                    )
+
+                if action is None:
+                    if isinstance(e, xmlrpc_client.Fault):
+                        raise WebFactionFault(e)
+                    raise
+
+                if action == 'login':
+                    may_log_in_again = False
+
+            attempt += 1
+
+    def create_email(self, email_address, timeout=None):
+        with self._operation(timeout):
+            return self._create_email(email_address)
+
+    def _create_email(self, email_address):
+        # Mailbox names may only contain lowercase letters, numbers
+        # and _.
+        mailbox_base = email_to_mailbox_name(email_address)
+        candidates = list(mailbox_name_candidates(mailbox_base))
+
+        refreshed = False
+
+        try:
+            self._load_mailbox_names()
+        except xmlrpc_client.Fault as e:
+            raise WebFactionFault(e)
+
+        while True:
+            mailbox = self._reserve_mailbox_name(candidates)
+
+            if mailbox is None and not refreshed:
+                # Every name we know of is taken, but some may have
+                # been freed since we listed the mailboxes, so list
+                # them again before giving up.
+                refreshed = True
+
+                try:
+                    self._load_mailbox_names(refresh=True)
+                except xmlrpc_client.Fault as e:
+                    raise WebFactionFault(e)
+                continue
+
+            last_attempt = mailbox is None
+
+            if last_attempt:
+                # The server still has every name, as far as we know,
+                # but let it have the final say.
+                mailbox = '%s%d' % (mailbox_base, MAX_MAILBOX_SUFFIX)
+
+            try:
+                mailbox_result = self._call('create_mailbox', mailbox)
+                break
+            except xmlrpc_client.Fault as e:
+                # Someone else took the name since we last listed the
+                # mailboxes, so try the next one.
+                if last_attempt:
+                    raise WebFactionFault(e)
+            finally:
+                self._settle_mailbox_name(mailbox)
+
+        try:
+            email_result = self._call(
+                'create_email',
+                email_address,
+                mailbox
+            )
+        except BaseException as e:
+            # Don't leave the mailbox behind, even if the call timed
+            # out or the caller was interrupted - unless the email may
+            # have been created before the call failed, since it would
+            # then deliver to a mailbox which no longer exists.
+            exc_info = sys.exc_info()
+
+            if (isinstance(e, xmlrpc_client.Fault) or
+                    not request_sent(e) or
+                    self._email_exists(email_address) is False):
+                self._delete_mailbox(mailbox)
+
+            if isinstance(e, xmlrpc_client.Fault):
+                raise WebFactionFault(e)
+            six.reraise(*exc_info)
+
+        return EmailRequestResponse(
+            mailbox,
+            mailbox_result['password'],
+            email_result['id'],
+        )
+
+    def _email_exists(self, email_address):
+        # Returns whether WebFaction has ``email_address``, or None if
+        # we can't find out.
+        try:
+            with self._cleanup():
+                emails = self._call('list_emails')
+        except Exception:
+            return None
+
+        return any(e['email_address'] == email_address for e in emails)
+
+    def _delete_mailbox(self, mailbox):
+        # Rolls back a mailbox we created. Failures are ignored, since
+        # the caller is already dealing with a more useful error.
+        try:
+            with self._cleanup():
+                self._call('delete_mailbox', mailbox)
+        except Exception:
+            return
+
+        self._release_mailbox_name(mailbox)
+
+    def create_emails(self, email_addresses,
+                      max_workers=DEFAULT_MAX_WORKERS, timeout=None):
+        def create_email(email_address):
+            return self.create_email(email_address, timeout=timeout)
+
+        return run_concurrently(
+            create_email,
+            email_addresses,
+            max_workers=max_workers
+        )
+
+    def create_email_forwarder(self, email_address, forwarding_addresses,
+                               timeout=None):
+        if not forwarding_addresses:
+            raise ValueError("Forwarders need at least one address.")
+
+        with self._operation(timeout):
+            try:
+                result = self._call(
+                    'create_email',
+                    email_address,
+                    ','.join(forwarding_addresses)
+                )
+
+                return result['id']
+            except xmlrpc_client.Fault as e:
+                raise WebFactionFault(e)
+
+    def create_email_forwarders(self, forwarders,
+                                max_workers=DEFAULT_MAX_WORKERS,
+                                timeout=None):
+        """Creates many forwarders at once. ``forwarders`` is an
+        iterable of ``(email_address, forwarding_addresses)`` pairs.
+        Yields ``(email_address, result)`` pairs as each one finishes,
+        like ``create_emails``.
+        """
+        def create_email_forwarder(forwarder):
+            email_address, forwarding_addresses = forwarder
+            return self.create_email_forwarder(
+                email_address,
+                forwarding_addresses,
+                timeout=timeout
+            )
+
+        results = run_concurrently(
+            create_email_forwarder,
+            forwarders,
+            max_workers=max_workers
+        )
+
+        for (email_address, _), result in results:
+            yield email_address, result
+
+    def update_email(self, email_address, targets, timeout=None):
+        """Replaces the mailboxes and forwarding addresses an email
+        address delivers to with ``targets``.
+        """
+        if not targets:
+            raise ValueError("Emails need at least one target.")
+
+        with self._operation(timeout):
+            try:
+                result = self._call(
+                    'update_email',
+                    email_address,
+                    ','.join(targets)
+                )
+
+                return result['id']
+            except xmlrpc_client.Fault as e:
+                raise WebFactionFault(e)
+
+    def delete_email(self, email_address, timeout=None):
+        """Deletes an email address. Its mailboxes are left alone."""
+        with self._operation(timeout):
+            try:
+                self._call('delete_email', email_address)
+            except xmlrpc_client.Fault as e:
+                raise WebFactionFault(e)
+
+    def reconcile(self, desired_state, delete=True, dry_run=False,
+                  max_workers=DEFAULT_MAX_WORKERS):
+        """Makes the account's email addresses match ``desired_state``.
+
+        See ``pywebfaction.reconcile`` for the format of
+        ``desired_state``. Returns the list of changes needed if
+        ``dry_run`` is set, and otherwise makes them all before
+        returning a list of ``(change, result)`` pairs, in the order
+        they finished. Use ``apply_changes`` to see results as they
+        come in.
+        """
+        changes = plan(
+            parse_desired_state(desired_state),
+            self.list_emails(),
+            self.list_mailboxes(),
+            delete=delete
+        )
+
+        if dry_run:
+            return changes
+
+        return list(apply_changes(self, changes, max_workers=max_workers))
+
+    def watch(self, **kwargs):
+        """Returns a ``Watcher``, which yields an ``EmailChange`` for
+        each email address added, removed or changed from now on. Any
+        keyword arguments are passed on to ``Watcher``.
+        """
+        return Watcher(self, **kwargs)
@@ -0,0 +1,172 @@
+from pywebfaction.exceptions import WebFactionFault
+from six.moves import xmlrpc_client
+
+
+DEFAULT_CHUNK_SIZE = 100
+
+# The fault code XML-RPC servers use for methods they don't have.
+METHOD_NOT_FOUND = -32601
+
+
+def _is_unsupported(fault):
+    # Servers which don't follow the convention, such as Python's
+    # SimpleXMLRPCServer, name the missing method in the message.
+    return (fault.faultCode == METHOD_NOT_FOUND or
+            'system.multicall' in str(fault.faultString))
+
+
+class BatchCall(object):
+    """The pending result of a call queued on a ``Batch``."""
+
+    def __init__(self, method, args, transform=None):
+        self.method = method
+        self.args = args
+        self.transform = transform
+        self.done = False
+        self._value = None
+        self._fault = None
+
+    def _set_value(self, value):
+        if self.transform is not None:
+            value = self.transform(value)
+        self._value = value
+        self.done = True
+
+    def _set_fault(self, fault):
+        self._fault = WebFactionFault(fault)
+        self.done = True
+
+    @property
+    def fault(self):
+        return self._fault
+
+    def result(self):
+        if not self.done:
+            raise RuntimeError("The batch has not been sent yet.")
+
+        if self._fault is not None:
+            raise self._fault
+
+        return self._value
+
+
+class Batch(object):
+    """Queues API calls and sends them with ``system.multicall``.
+
+    Calls are sent in chunks of ``chunk_size`` when the batch is sent
+    (which happens automatically at the end of a ``with`` block). Each
+    queued call returns a ``BatchCall``, whose ``result()`` gives back
+    the value of the call, or raises its ``WebFactionFault``.
+
+    If the server doesn't support ``system.multicall``, the calls are
+    made one at a time instead.
+    """
+
+    def __init__(self, api, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.api = api
+        self.chunk_size = chunk_size
+        self._queue = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.send()
+
+    def call(self, method, *args, **kwargs):
+        call = BatchCall(method, args, kwargs.get('transform'))
+        self._queue.append(call)
+        return call
+
+    def create_mailbox(self, mailbox):
+        return self.call('create_mailbox', mailbox)
+
+    def delete_mailbox(self, mailbox):
+        return self.call('delete_mailbox', mailbox)
+
+    def create_email_forwarder(self, email_address, forwarding_addresses):
+        return self.call(
+            'create_email',
+            email_address,
+            ','.join(forwarding_addresses),
+            transform=lambda result: result['id']
+        )
+
+    def update_email(self, email_address, targets):
+        return self.call(
+            'update_email',
+            email_address,
+            ','.join(targets),
+            transform=lambda result: result['id']
+        )
+
+    def delete_email(self, email_address):
+        return self.call('delete_email', email_address)
+
+    def send(self):
+        queue, self._queue = self._queue, []
+
+        for start in range(0, len(queue), self.chunk_size):
+            chunk = queue[start:start + self.chunk_size]
+
+            if self.api.supports_multicall:
+                try:
+                    self._send_multicall(chunk)
+                    continue
+                except xmlrpc_client.Fault as e:
+                    if not _is_unsupported(e):
+                        # The whole chunk failed (after any retries),
+                        # but multicall itself works.
+                        for call in chunk:
+                            call._set_fault(e)
+                        continue
+
+                    self.api.supports_multicall = False
+
+            self._send_sequentially(chunk)
+
+    def _send_multicall(self, calls):
+        session_id = self.api.session_id
+        results = self._multicall(calls)
+        expired = [
+            call for call, result in zip(calls, results)
+            if self.api._is_session_fault(result)
+        ]
+
+        if expired:
+            self.api._session_expired(session_id)
+            retried = dict(zip(
+                [id(call) for call in expired],
+                self._multicall(expired)
+            ))
+            results = [retried.get(id(call), result)
+                       for call, result in zip(calls, results)]
+
+        for call, result in zip(calls, results):
+            if isinstance(result, xmlrpc_client.Fault):
+                call._set_fault(result)
+            else:
+                call._set_value(result)
+
+    def _multicall(self, calls):
+        results = self.api._request_with_retries('system.multicall', ([
+            {
+                'methodName': call.method,
+                'params': [self.api.session_id, ] + list(call.args),
+            }
+            for call in calls
+        ], ), with_session=False)
+
+        return [
+            xmlrpc_client.Fault(r['faultCode'], r['faultString'])
+            if isinstance(r, dict) else r[0]
+            for r in results
+        ]
+
+    def _send_sequentially(self, calls):
+        for call in calls:
+            try:
+                call._set_value(self.api._call(call.method, *call.args))
+            except xmlrpc_client.Fault as e:
+                call._set_fault(e)
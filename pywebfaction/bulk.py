@@ -0,0 +1,41 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
+
+
+DEFAULT_MAX_WORKERS = 8
+
+
+def run_concurrently(function, items, max_workers=DEFAULT_MAX_WORKERS):
+    """Calls ``function`` on each item using a pool of threads.
+
+    Yields ``(item, result)`` pairs in the order the calls finish. A
+    call which fails gives the exception as its result rather than
+    stopping the whole run, so that every item which was started is
+    reported - even after a network error or timeout.
+
+    Items are pulled from ``items`` as workers become free, so it can
+    be a generator over more items than fit comfortably in memory.
+    """
+    items = iter(items)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = dict(
+            (executor.submit(function, item), item)
+            for item in islice(items, max_workers * 2)
+        )
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                item = pending.pop(future)
+
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = e
+
+                for new_item in islice(items, 1):
+                    pending[executor.submit(function, new_item)] = new_item
+
+                yield item, result
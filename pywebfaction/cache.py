@@ -0,0 +1,141 @@
+import threading
+import time
+
+from pywebfaction.utils import Email
+
+
+DEFAULT_TTL = 60
+
+
+class EmailDirectory(object):
+    """A cached, indexed view of the email addresses in an account.
+
+    The first lookup downloads the account's email addresses, and
+    later lookups are answered from memory until the listing is more
+    than ``ttl`` seconds old, at which point it is thrown away and
+    downloaded again. Lookups by address, by mailbox and by forwarding
+    address are all dictionary lookups.
+
+    Emails created through the directory's ``create_email`` and
+    ``create_email_forwarder`` are added to the cached listing
+    straight away, rather than waiting for the next download.
+    """
+
+    def __init__(self, api, ttl=DEFAULT_TTL, clock=time.time):
+        self.api = api
+        self.ttl = ttl
+        self.clock = clock
+        self._lock = threading.RLock()
+        self._loaded_at = None
+        self._by_address = {}
+        self._by_mailbox = {}
+        self._by_forward = {}
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+            self._by_address = {}
+            self._by_mailbox = {}
+            self._by_forward = {}
+
+    def refresh(self):
+        emails = list(self.api.iter_emails())
+
+        with self._lock:
+            self.invalidate()
+
+            for email in emails:
+                self._add(email)
+
+            self._loaded_at = self.clock()
+
+    def _is_fresh(self):
+        return (
+            self._loaded_at is not None and
+            self.clock() - self._loaded_at <= self.ttl
+        )
+
+    def _ensure_fresh(self):
+        if not self._is_fresh():
+            self.refresh()
+
+    def _add(self, email):
+        self._remove(email.address)
+        self._by_address[email.address] = email
+
+        for mailbox in email.mailboxes:
+            self._by_mailbox.setdefault(mailbox, set()).add(email.address)
+
+        for forward in email.forwards_to:
+            self._by_forward.setdefault(forward, set()).add(email.address)
+
+    def _remove(self, address):
+        email = self._by_address.pop(address, None)
+
+        if email is None:
+            return
+
+        # An email can list the same target twice, so each key is
+        # only removed once.
+        for index, keys in ((self._by_mailbox, email.mailboxes),
+                            (self._by_forward, email.forwards_to)):
+            for key in set(keys):
+                addresses = index.get(key)
+                addresses.discard(address)
+                if not addresses:
+                    del index[key]
+
+    def _lookup(self, index_name, key):
+        with self._lock:
+            # Refreshing replaces the indexes, so only look the index
+            # up afterwards.
+            self._ensure_fresh()
+            index = getattr(self, index_name)
+            return [self._by_address[address]
+                    for address in sorted(index.get(key, ()))]
+
+    def get(self, address):
+        with self._lock:
+            self._ensure_fresh()
+            return self._by_address.get(address)
+
+    def __contains__(self, address):
+        return self.get(address) is not None
+
+    def __len__(self):
+        with self._lock:
+            self._ensure_fresh()
+            return len(self._by_address)
+
+    def __iter__(self):
+        with self._lock:
+            self._ensure_fresh()
+            return iter(list(self._by_address.values()))
+
+    def by_mailbox(self, mailbox):
+        return self._lookup('_by_mailbox', mailbox)
+
+    def forwarding_to(self, address):
+        return self._lookup('_by_forward', address)
+
+    def _write_through(self, address, targets):
+        with self._lock:
+            # Only worth updating a listing we'd still use.
+            if self._is_fresh():
+                self._add(Email({
+                    'email_address': address,
+                    'targets': targets,
+                }))
+
+    def create_email(self, email_address):
+        response = self.api.create_email(email_address)
+        self._write_through(email_address, response.mailbox)
+        return response
+
+    def create_email_forwarder(self, email_address, forwarding_addresses):
+        email_id = self.api.create_email_forwarder(
+            email_address,
+            forwarding_addresses
+        )
+        self._write_through(email_address, ','.join(forwarding_addresses))
+        return email_id
@@ -2,23 +2,40 @@
 
 Usage:
   pywebfaction generate_config --username=<username> --password=<password>
-  pywebfaction list_emails
+  pywebfaction list_emails [--format=<format>] [--all-accounts]
   pywebfaction create_email <addr>
   pywebfaction create_forwarder <addr> <fwd1>
+  pywebfaction bulk_create [<file>] [--workers=<n>]
+  pywebfaction bulk_forward [<file>] [--workers=<n>]
+  pywebfaction sync <file> [--dry-run] [--no-delete] [--workers=<n>]
+  pywebfaction watch [--min-interval=<seconds>] [--max-interval=<seconds>]
   pywebfaction (-h | --help)
   pywebfaction --version
 
 Options:
-  -h --help     Show this screen.
-  --version     Show version.
+  -h --help                 Show this screen.
+  --version                 Show version.
+  --workers=<n>             Number of requests to make at once [default: 8].
+  --format=<format>         How to print the list: table, jsonl, csv or tsv
+                            [default: table].
+  --all-accounts            List the emails of every account in the
+                            configuration file.
+  --dry-run                 Print the changes sync would make, without making
+                            them.
+  --no-delete               Don't delete email addresses missing from the file.
+  --min-interval=<seconds>  Shortest time between polls [default: 15].
+  --max-interval=<seconds>  Longest time between polls [default: 600].
 
 """
 from __future__ import print_function
-from docopt import docopt
 from os import path
-from pywebfaction import WebFactionAPI, WebFactionFault
-from six.moves import configparser
-from tabulate import tabulate
+import sys
+
+# Only the modules every command needs are imported up front. The rest
+# are imported by the commands which use them, so that quick commands
+# (like --help) don't pay for importing the API client.
+
+VERSION = 'pywebfaction 0.1.2'
 
 
 def get_config_filename():
@@ -26,15 +43,40 @@ def get_config_filename():
     return path.join(home, "pywebfaction.ini")
 
 
+def get_session_cache_filename():
+    home = path.expanduser("~")
+    return path.join(home, ".pywebfaction.sessions")
+
+
 def get_handle():
+    from pywebfaction import WebFactionAPI
+    from pywebfaction.session import SessionCache
+    from six.moves import configparser
+
     config = configparser.RawConfigParser()
     config.read(get_config_filename())
     username = config.get('pywebfaction', 'username')
     password = config.get('pywebfaction', 'password')
-    return WebFactionAPI(username, password)
+    return WebFactionAPI(
+        username,
+        password,
+        session_cache=SessionCache(get_session_cache_filename())
+    )
+
+
+def get_accounts():
+    from pywebfaction.accounts import WebFactionAccounts
+    from pywebfaction.session import SessionCache
+
+    return WebFactionAccounts.from_config(
+        get_config_filename(),
+        session_cache=SessionCache(get_session_cache_filename())
+    )
 
 
 def generate_config(arguments):
+    from six.moves import configparser
+
     config = configparser.RawConfigParser()
 
     config.add_section('pywebfaction')
@@ -45,18 +87,107 @@ def generate_config(arguments):
         config.write(configfile)
 
 
+LIST_HEADERS = ["Email", "Mailboxes", "Forwards"]
+
+
+def email_row(account, email):
+    row = (
+        email.address,
+        '; '.join(email.mailboxes),
+        '; '.join(email.forwards_to)
+    )
+
+    if account is None:
+        return row
+
+    return (account, ) + row
+
+
+def list_headers(show_account):
+    if show_account:
+        return ["Account"] + LIST_HEADERS
+    return LIST_HEADERS
+
+
+def write_table(entries, show_account):
+    # The table has to be laid out as a whole, so this is the one
+    # format which holds every email in memory.
+    from tabulate import tabulate
+
+    print(tabulate(
+        [email_row(account, email) for account, email in entries],
+        list_headers(show_account)
+    ))
+
+
+def write_jsonl(entries, show_account):
+    import json
+
+    for account, email in entries:
+        if account is None:
+            sys.stdout.write(email.to_json() + '\n')
+        else:
+            line = email.to_dict()
+            line['account'] = account
+            sys.stdout.write(json.dumps(line) + '\n')
+
+
+def write_delimited(entries, show_account, dialect):
+    import csv
+
+    writer = csv.writer(sys.stdout, dialect=dialect)
+    writer.writerow(list_headers(show_account))
+
+    for account, email in entries:
+        writer.writerow(email_row(account, email))
+
+
+LIST_FORMATS = {
+    'table': write_table,
+    'jsonl': write_jsonl,
+    'csv': lambda entries, show_account: write_delimited(
+        entries, show_account, 'excel'
+    ),
+    'tsv': lambda entries, show_account: write_delimited(
+        entries, show_account, 'excel-tab'
+    ),
+}
+
+
 def list_emails(arguments):
+    write = LIST_FORMATS.get(arguments['--format'])
+
+    if write is None:
+        print("Unknown format %s - use one of %s."
+              % (arguments['--format'], ', '.join(sorted(LIST_FORMATS))))
+        return 1
+
+    if arguments['--all-accounts']:
+        return list_all_emails(write)
+
+    # Apart from the table, each email is written out as soon as it
+    # has been parsed from the response.
     api = get_handle()
-    emails = api.list_emails()
-    rows = [
-        (
-            e.address,
-            '; '.join(e.mailboxes),
-            '; '.join(e.forwards_to)
-        )
-        for e in emails
-    ]
-    print(tabulate(rows, ["Email", "Mailboxes", "Forwards"]))
+    write(((None, email) for email in api.iter_emails()), False)
+
+
+def list_all_emails(write):
+    accounts = get_accounts()
+
+    if not accounts.names:
+        print("No accounts configured - please run pywebfaction "
+              "generate_config.")
+        return 1
+
+    write(accounts.list_emails(), True)
+
+    for name in sorted(accounts.errors):
+        error = accounts.errors[name]
+        message = getattr(error, 'exception_message', None) or error
+        sys.stderr.write("Couldn't list emails for %s: %s\n"
+                         % (name, message))
+
+    return 1 if accounts.errors else 0
 
 
 def create_email(arguments):
@@ -75,8 +206,182 @@ def create_forwarder(arguments):
     print("Your email forwarder was successfully set up.")
 
 
-def main():
-    arguments = docopt(__doc__, version='pywebfaction 0.1.2')
+def open_input(filename):
+    if filename is None or filename == '-':
+        return sys.stdin
+
+    if sys.version_info[0] < 3:
+        return open(filename, 'rb')
+
+    return open(filename, newline='')
+
+
+def read_rows(filename):
+    """Yields the non-blank rows of a CSV file (or stdin), with
+    surrounding whitespace stripped from each field.
+    """
+    import csv
+
+    stream = open_input(filename)
+
+    try:
+        for row in csv.reader(stream):
+            row = [field.strip() for field in row if field.strip()]
+            if row:
+                yield row
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+
+def describe_address(address, result=None):
+    line = {'address': address}
+    if result is not None:
+        line.update(result)
+    return line
+
+
+def write_results(results, describe, identify=describe_address):
+    # Writes one JSON object per line as each ``(item, result)`` pair
+    # comes in, and returns 1 if any of them failed.
+    import json
+    from pywebfaction import WebFactionFault
+
+    status = 0
+
+    for item, result in results:
+        if isinstance(result, Exception):
+            status = 1
+            message = str(result)
+            if isinstance(result, WebFactionFault):
+                message = result.exception_message or message
+            line = identify(item)
+            line['error'] = message
+        else:
+            line = describe(item, result)
+
+        print(json.dumps(line, sort_keys=True))
+        sys.stdout.flush()
+
+    return status
+
+
+def bulk_create(arguments):
+    api = get_handle()
+    results = api.create_emails(
+        (row[0] for row in read_rows(arguments['<file>'])),
+        max_workers=int(arguments['--workers'])
+    )
+    return write_results(
+        results,
+        lambda address, response: describe_address(address, response.to_dict())
+    )
+
+
+def bulk_forward(arguments):
+    api = get_handle()
+    results = api.create_email_forwarders(
+        ((row[0], row[1:]) for row in read_rows(arguments['<file>'])),
+        max_workers=int(arguments['--workers'])
+    )
+    return write_results(
+        results,
+        lambda address, email_id: describe_address(
+            address,
+            {'email_id': email_id}
+        )
+    )
+
+
+def describe_change(change, result=None):
+    line = change.to_dict()
+
+    if isinstance(result, dict) and 'password' in result:
+        line['password'] = result['password']
+
+    return line
+
+
+def sync(arguments):
+    from pywebfaction.reconcile import load_desired_state
+
+    try:
+        desired_state = load_desired_state(arguments['<file>'])
+    except (IOError, ImportError, ValueError) as e:
+        print("Couldn't read %s: %s" % (arguments['<file>'], e))
+        return 1
+
+    api = get_handle()
+
+    try:
+        changes = api.reconcile(
+            desired_state,
+            delete=not arguments['--no-delete'],
+            dry_run=True
+        )
+    except ValueError as e:
+        print("Couldn't read %s: %s" % (arguments['<file>'], e))
+        return 1
+
+    if not changes:
+        print("Nothing to do.")
+        return 0
+
+    for change in changes:
+        print(change)
+
+    if arguments['--dry-run']:
+        return 0
+
+    from pywebfaction.reconcile import apply_changes
+
+    results = apply_changes(
+        api,
+        changes,
+        max_workers=int(arguments['--workers'])
+    )
+    return write_results(results, describe_change, describe_change)
+
+
+def watch(arguments):
+    import json
+
+    api = get_handle()
+
+    def report(error):
+        sys.stderr.write("Polling failed, will try again: %s\n" % error)
+
+    watcher = api.watch(
+        min_interval=float(arguments['--min-interval']),
+        max_interval=float(arguments['--max-interval']),
+        on_error=report
+    )
+
+    try:
+        for change in watcher:
+            print(json.dumps(change.to_dict(), sort_keys=True))
+            sys.stdout.flush()
+    except KeyboardInterrupt:
+        pass
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+
+    # Answer --help and --version without importing docopt.
+    if argv in (['-h'], ['--help']):
+        print(__doc__.strip())
+        return
+    if argv == ['--version']:
+        print(VERSION)
+        return
+
+    from docopt import docopt
+    from pywebfaction import WebFactionFault
+    from six.moves import configparser
+
+    arguments = docopt(__doc__, argv=argv, version=VERSION)
     try:
         if arguments['generate_config']:
             return generate_config(arguments)
@@ -86,6 +391,14 @@ def main():
             return create_email(arguments)
         if arguments['create_forwarder']:
             return create_forwarder(arguments)
+        if arguments['bulk_create']:
+            return bulk_create(arguments)
+        if arguments['bulk_forward']:
+            return bulk_forward(arguments)
+        if arguments['sync']:
+            return sync(arguments)
+        if arguments['watch']:
+            return watch(arguments)
     except configparser.NoSectionError as e:
         print("Bad configuration file - please run pywebfaction "
               "generate_config.")
@@ -1,9 +1,19 @@
 import ast
+import re
+
+import six
 
 
 EXCEPTION_TYPE_PREFIX = "<class 'webfaction_api.exceptions."
 EXCEPTION_TYPE_SUFFIX = "'>"
 
+# Matches the first item of a message like "[u'Some message.', ...]",
+# which is the only part of it we use.
+_MESSAGE_PATTERN = re.compile(
+    r"""\[\s*[uU]?(?:'((?:[^'\\]|\\.)*)'|"((?:[^"\\]|\\.)*)")\s*[,\]]""",
+    re.DOTALL
+)
+
 
 def _parse_exc_type(exc_type):
     # This is horribly hacky, but there's not a particularly elegant
@@ -18,27 +28,87 @@ def _parse_exc_type(exc_type):
     return exc_type[len(EXCEPTION_TYPE_PREFIX):len(EXCEPTION_TYPE_SUFFIX) * -1]
 
 
-def _parse_exc_message(exc_message):
-    if not exc_message:
+def _literal_eval(text):
+    try:
+        return ast.literal_eval(text)
+    except (ValueError, SyntaxError, TypeError, MemoryError, RuntimeError):
+        # RuntimeError covers messages nested too deeply to parse.
         return None
 
-    message = ast.literal_eval(exc_message)
 
-    if isinstance(message, list):
-        if not message:
+def _parse_exc_message(exc_message):
+    # There's sometimes a space after the colon.
+    exc_message = exc_message.lstrip()
+    match = _MESSAGE_PATTERN.match(exc_message)
+
+    if match is None:
+        if not exc_message.startswith('['):
             return None
-        return message[0]
 
-    return None
+        # Something unusual, like a list of numbers, so fall back to
+        # parsing it properly.
+        message = _literal_eval(exc_message)
+
+        if isinstance(message, list) and message:
+            return message[0]
+
+        return None
+
+    single, double = match.groups()
+    message = single if double is None else double
+
+    if '\\' in message:
+        # Leave unescaping to Python.
+        quote = "'" if double is None else '"'
+        return _literal_eval('u' + quote + message + quote)
+
+    return message
+
+
+_UNPARSED = object()
 
 
 class WebFactionFault(Exception):
+    """Wraps an ``xmlrpc_client.Fault`` from WebFaction.
+
+    ``exception_type`` and ``exception_message`` are parsed out of the
+    fault string the first time each is used, since jobs which make
+    lots of calls can expect plenty of faults they never look inside.
+    Both are ``None`` if the fault string isn't in the usual format.
+    """
+
     def __init__(self, underlying):
         self.underlying_fault = underlying
-        try:
-            exc_type, exc_message = underlying.faultString.split(':', 1)
-            self.exception_type = _parse_exc_type(exc_type)
-            self.exception_message = _parse_exc_message(exc_message)
-        except ValueError:
-            self.exception_type = None
-            self.exception_message = None
+        self._parts = None
+        self._exception_type = _UNPARSED
+        self._exception_message = _UNPARSED
+
+    def _split(self):
+        # Returns the fault string's type and message parts, or None
+        # if it isn't in the usual format.
+        if self._parts is None:
+            fault_string = getattr(self.underlying_fault, 'faultString', None)
+            parts = ()
+
+            if isinstance(fault_string, six.string_types):
+                exc_type, sep, exc_message = fault_string.partition(':')
+                if sep:
+                    parts = (exc_type, exc_message)
+
+            self._parts = parts
+
+        return self._parts or None
+
+    @property
+    def exception_type(self):
+        if self._exception_type is _UNPARSED:
+            parts = self._split()
+            self._exception_type = parts and _parse_exc_type(parts[0])
+        return self._exception_type
+
+    @property
+    def exception_message(self):
+        if self._exception_message is _UNPARSED:
+            parts = self._split()
+            self._exception_message = parts and _parse_exc_message(parts[1])
+        return self._exception_message
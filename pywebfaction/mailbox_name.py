@@ -1,31 +1,75 @@
 import string
 
+import six
 
-def email_to_mailbox_name(email_address):
-    if not email_address:
-        raise ValueError("E-mail addresses cannot be empty.")
 
-    email_address = email_address.lower()
-    valid_characters = string.ascii_letters + string.digits + '_'
+# How many numbered variants of a mailbox name we'll try before giving
+# up, e.g. foo_examplecom1 to foo_examplecom10.
+MAX_MAILBOX_SUFFIX = 10
 
-    def is_valid_character(c):
-        return c in valid_characters
 
-    def make_valid(c):
-        if is_valid_character(c):
-            return c
+class _MailboxNameTable(dict):
+    # A str.translate table which keeps valid characters, turns '@'
+    # into '_', and drops everything else.
+    def __missing__(self, key):
+        self[key] = None
+        return None
 
-        if c == '@':
-            return '_'
 
-        return ''
+_TRANSLATION_TABLE = _MailboxNameTable(
+    (ord(c), c)
+    for c in string.ascii_lowercase + string.digits + '_'
+)
+_TRANSLATION_TABLE[ord('@')] = '_'
 
-    joined_up = ''.join([make_valid(c) for c in email_address])
 
-    if joined_up == '_' * len(joined_up):
+def email_to_mailbox_name(email_address):
+    if not email_address:
+        raise ValueError("E-mail addresses cannot be empty.")
+
+    joined_up = six.text_type(email_address).lower().translate(
+        _TRANSLATION_TABLE
+    )
+
+    if not joined_up.strip('_'):
         raise ValueError(
             "Mailbox names must contain at least one valid "
             "character."
         )
 
-    return joined_up
+    return str(joined_up)
+
+
+def email_to_mailbox_names(email_addresses, taken=()):
+    """Generates mailbox names for many email addresses at once.
+
+    Where two addresses would get the same mailbox name, or a name is
+    already in ``taken``, a number is added to the end, in the same way
+    as ``WebFactionAPI.create_email`` does, so the names returned are
+    all distinct. The result is in the same order as the addresses.
+    """
+    taken = set(taken)
+    next_suffix = {}
+    names = []
+
+    for email_address in email_addresses:
+        mailbox_base = email_to_mailbox_name(email_address)
+        mailbox = mailbox_base
+        suffix = next_suffix.get(mailbox_base, 0)
+
+        while mailbox in taken:
+            suffix += 1
+            mailbox = '%s%d' % (mailbox_base, suffix)
+
+        next_suffix[mailbox_base] = suffix
+        taken.add(mailbox)
+        names.append(mailbox)
+
+    return names
+
+
+def mailbox_name_candidates(mailbox_base, max_suffix=MAX_MAILBOX_SUFFIX):
+    yield mailbox_base
+
+    for suffix in range(1, max_suffix + 1):
+        yield '%s%d' % (mailbox_base, suffix)
@@ -0,0 +1,152 @@
+import bisect
+import threading
+
+
+# Upper bounds (in seconds) of the LatencyHistogram buckets.
+DEFAULT_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+
+class CallEvent(object):
+    """Describes a single XML-RPC request made by ``WebFactionAPI``.
+
+    ``retries`` is the number of earlier attempts at the same call,
+    ``fault_type`` is the ``WebFactionFault.exception_type`` of a
+    fault response, and ``error`` is any other exception raised (such
+    as a network error). Byte counts are ``None`` when the transport
+    doesn't report them.
+    """
+
+    __slots__ = (
+        'method',
+        'duration',
+        'request_bytes',
+        'response_bytes',
+        'retries',
+        'fault_type',
+        'error',
+    )
+
+    def __init__(self, method, duration, request_bytes=None,
+                 response_bytes=None, retries=0, fault_type=None,
+                 error=None):
+        self.method = method
+        self.duration = duration
+        self.request_bytes = request_bytes
+        self.response_bytes = response_bytes
+        self.retries = retries
+        self.fault_type = fault_type
+        self.error = error
+
+    @property
+    def failed(self):
+        return self.fault_type is not None or self.error is not None
+
+    def __repr__(self):
+        return '<CallEvent: %s %.3fs>' % (self.method, self.duration)
+
+
+class CallCounter(object):
+    """An observer which counts calls, failures, retries and bytes
+    transferred per method.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = {}
+        self.failures = {}
+        self.faults = {}
+        self.retries = {}
+        self.request_bytes = {}
+        self.response_bytes = {}
+
+    def __call__(self, event):
+        method = event.method
+
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+
+            if event.failed:
+                self.failures[method] = self.failures.get(method, 0) + 1
+
+            if event.fault_type is not None:
+                key = (method, event.fault_type)
+                self.faults[key] = self.faults.get(key, 0) + 1
+
+            if event.retries:
+                self.retries[method] = self.retries.get(method, 0) + 1
+
+            for totals, size in ((self.request_bytes, event.request_bytes),
+                                 (self.response_bytes, event.response_bytes)):
+                if size is not None:
+                    totals[method] = totals.get(method, 0) + size
+
+
+class LatencyHistogram(object):
+    """An observer which keeps a histogram of call durations per
+    method, and can estimate percentiles from it.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._counts = {}
+        self._totals = {}
+
+    def __call__(self, event):
+        index = bisect.bisect_left(self.buckets, event.duration)
+
+        with self._lock:
+            counts = self._counts.get(event.method)
+
+            if counts is None:
+                counts = self._counts[event.method] = [0] * (
+                    len(self.buckets) + 1
+                )
+
+            counts[index] += 1
+            self._totals[event.method] = (
+                self._totals.get(event.method, 0) + event.duration
+            )
+
+    def methods(self):
+        return sorted(self._counts)
+
+    def counts(self, method):
+        """Returns ``(upper_bound, count)`` pairs for ``method``. The
+        last bound is ``None``, for calls slower than every bucket.
+        """
+        counts = self._counts.get(method, [0] * (len(self.buckets) + 1))
+        return list(zip(self.buckets + (None, ), counts))
+
+    def count(self, method):
+        return sum(self._counts.get(method, ()))
+
+    def mean(self, method):
+        count = self.count(method)
+
+        if not count:
+            return None
+
+        return self._totals[method] / count
+
+    def percentile(self, method, fraction):
+        """Returns the upper bound of the bucket containing the given
+        percentile (e.g. 0.99) of calls to ``method``, or ``None`` if
+        it's beyond the last bucket or there have been no calls.
+        """
+        count = self.count(method)
+
+        if not count:
+            return None
+
+        target = fraction * count
+        seen = 0
+
+        for bound, bucket_count in self.counts(method):
+            seen += bucket_count
+            if seen >= target:
+                return bound
+
+        return None
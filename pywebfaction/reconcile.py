@@ -0,0 +1,250 @@
+"""Works out, and makes, the changes needed to bring an account's email
+addresses in line with a description of how they should be.
+
+The desired state is a mapping from each email address to what it
+should deliver to - either a list of targets (mailbox names and
+forwarding addresses), or a mapping with ``mailboxes`` and/or
+``forwards_to`` lists::
+
+    {
+        "me@example.com": {"mailboxes": ["me_examplecom"]},
+        "sales@example.com": {"forwards_to": ["alice@example.org"]},
+        "info@example.com": ["me_examplecom", "bob@example.org"]
+    }
+
+Mailboxes which don't exist yet are created. Mailboxes are never
+deleted, since that would throw away the mail in them.
+"""
+import json
+from os import path
+
+from pywebfaction.batch import DEFAULT_CHUNK_SIZE
+from pywebfaction.bulk import DEFAULT_MAX_WORKERS, run_concurrently
+
+
+CREATE_MAILBOX = 'create_mailbox'
+CREATE = 'create'
+UPDATE = 'update'
+DELETE = 'delete'
+
+SPEC_FIELDS = ('mailboxes', 'forwards_to')
+
+
+class Change(object):
+    """A single step of a reconciliation plan."""
+
+    __slots__ = ('action', 'name', 'targets')
+
+    SYMBOLS = {
+        CREATE_MAILBOX: '+',
+        CREATE: '+',
+        UPDATE: '~',
+        DELETE: '-',
+    }
+
+    def __init__(self, action, name, targets=()):
+        self.action = action
+        self.name = name
+        self.targets = tuple(targets)
+
+    def _key(self):
+        return (self.action, self.name, self.targets)
+
+    def __eq__(self, other):
+        if not isinstance(other, Change):
+            return NotImplemented
+
+        return self._key() == other._key()
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+
+        if result is NotImplemented:
+            return result
+
+        return not result
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def to_dict(self):
+        return {
+            'action': self.action,
+            'name': self.name,
+            'targets': list(self.targets),
+        }
+
+    def __repr__(self):
+        return '<Change: %s %s>' % (self.action, self.name)
+
+    def __str__(self):
+        symbol = self.SYMBOLS[self.action]
+
+        if self.action == CREATE_MAILBOX:
+            return '%s mailbox %s' % (symbol, self.name)
+
+        if not self.targets:
+            return '%s %s' % (symbol, self.name)
+
+        return '%s %s -> %s' % (symbol, self.name, ', '.join(self.targets))
+
+
+def _parse_spec(address, spec):
+    if isinstance(spec, list):
+        targets = spec
+    elif isinstance(spec, dict):
+        unknown = set(spec) - set(SPEC_FIELDS)
+        if unknown:
+            raise ValueError("Unknown field(s) for %s: %s."
+                             % (address, ', '.join(sorted(unknown))))
+
+        targets = (
+            list(spec.get('mailboxes') or ()) +
+            list(spec.get('forwards_to') or ())
+        )
+    else:
+        raise ValueError("Expected a list or mapping for %s." % address)
+
+    if not targets:
+        raise ValueError("%s needs at least one target." % address)
+
+    return tuple(targets)
+
+
+def parse_desired_state(desired_state):
+    """Checks a desired state, and returns a dictionary mapping each
+    email address to a tuple of its targets.
+    """
+    if not isinstance(desired_state, dict):
+        raise ValueError("Expected a mapping of email addresses.")
+
+    return dict(
+        (address, _parse_spec(address, spec))
+        for address, spec in desired_state.items()
+    )
+
+
+def load_desired_state(filename):
+    """Reads a desired state from a JSON or YAML file. YAML needs
+    PyYAML to be installed.
+    """
+    with open(filename) as f:
+        if path.splitext(filename)[1].lower() not in ('.yaml', '.yml'):
+            return json.load(f)
+
+        try:
+            import yaml
+        except ImportError:
+            raise ImportError("Reading YAML files needs PyYAML - install "
+                              "it, or use JSON instead.")
+
+        return yaml.safe_load(f)
+
+
+def _is_mailbox(target):
+    return '@' not in target
+
+
+def plan(desired, emails, mailboxes=(), delete=True):
+    """Returns the changes needed to go from ``emails`` (the account's
+    current ``Email`` objects) to ``desired`` (as returned by
+    ``parse_desired_state``).
+
+    Targets are compared as sets, so an address whose targets are
+    merely listed in a different order is left alone. Addresses which
+    aren't in ``desired`` are deleted, unless ``delete`` is false.
+    """
+    current = dict((email.address, email) for email in emails)
+    existing_mailboxes = set(mailboxes)
+    new_mailboxes = set()
+    changes = []
+
+    for address in sorted(desired):
+        targets = desired[address]
+        new_mailboxes.update(
+            target for target in targets
+            if _is_mailbox(target) and target not in existing_mailboxes
+        )
+
+        email = current.get(address)
+
+        if email is None:
+            changes.append(Change(CREATE, address, targets))
+        elif set(targets) != set(email.mailboxes + email.forwards_to):
+            changes.append(Change(UPDATE, address, targets))
+
+    if delete:
+        changes.extend(
+            Change(DELETE, address)
+            for address in sorted(set(current) - set(desired))
+        )
+
+    return [
+        Change(CREATE_MAILBOX, mailbox) for mailbox in sorted(new_mailboxes)
+    ] + changes
+
+
+def _queue(batch, change):
+    if change.action == CREATE_MAILBOX:
+        return batch.create_mailbox(change.name)
+
+    if change.action == CREATE:
+        return batch.create_email_forwarder(change.name, change.targets)
+
+    if change.action == UPDATE:
+        return batch.update_email(change.name, change.targets)
+
+    return batch.delete_email(change.name)
+
+
+def apply_changes(api, changes, chunk_size=DEFAULT_CHUNK_SIZE,
+                  max_workers=DEFAULT_MAX_WORKERS):
+    """Makes the changes in a plan, yielding ``(change, result)`` pairs
+    as they finish, where ``result`` is what the call returned, or the
+    exception it failed with.
+
+    New mailboxes are created first, since emails may deliver to them.
+    Changes are sent in batches of ``chunk_size``, with up to
+    ``max_workers`` batches in flight at once. Emails which deliver to
+    a mailbox that couldn't be created are skipped.
+    """
+    def send(chunk):
+        with api.batch(chunk_size=len(chunk)) as batch:
+            calls = [_queue(batch, change) for change in chunk]
+
+        return [call.fault or call.result() for call in calls]
+
+    failed_mailboxes = set()
+    phases = (
+        [c for c in changes if c.action == CREATE_MAILBOX],
+        [c for c in changes if c.action != CREATE_MAILBOX],
+    )
+
+    for phase in phases:
+        runnable = []
+
+        for change in phase:
+            missing = failed_mailboxes.intersection(change.targets)
+
+            if missing:
+                yield change, ValueError(
+                    "Mailbox %s could not be created." % sorted(missing)[0]
+                )
+            else:
+                runnable.append(change)
+
+        chunks = [
+            runnable[start:start + chunk_size]
+            for start in range(0, len(runnable), chunk_size)
+        ]
+
+        for chunk, results in run_concurrently(send, chunks, max_workers):
+            if isinstance(results, Exception):
+                results = [results] * len(chunk)
+
+            for change, result in zip(chunk, results):
+                if (change.action == CREATE_MAILBOX and
+                        isinstance(result, Exception)):
+                    failed_mailboxes.add(change.name)
+
+                yield change, result
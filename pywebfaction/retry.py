@@ -0,0 +1,140 @@
+import random
+import socket
+import time
+
+from pywebfaction.exceptions import WebFactionFault
+from six.moves import http_client, xmlrpc_client
+
+
+# Faults which mean the request itself was wrong, so making it again
+# can't help. These are never retried, whatever the policy says.
+PERMANENT_FAULT_TYPES = frozenset([
+    'DataError',
+    'LoginError',
+    'PermissionError',
+    'SessionError',
+    'ValidationError',
+])
+
+# Faults which mean something went wrong on WebFaction's side, and
+# may well work if we try again.
+RETRYABLE_FAULT_TYPES = frozenset([
+    'InternalError',
+    'ServerError',
+    'TemporaryError',
+])
+
+# HTTP statuses worth trying again.
+RETRYABLE_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+# Of those, the ones which mean the server didn't act on the request.
+# With the others, it may have done so before failing.
+UNPROCESSED_STATUSES = frozenset([429, 503])
+
+# Methods which only read, so making them twice does no harm.
+SAFE_METHODS = frozenset([
+    'list_emails',
+    'list_mailboxes',
+    'login',
+])
+
+
+def request_sent(error):
+    """Returns whether the request may have reached the server before
+    ``error``. Errors raised while connecting, or while waiting for the
+    rate limiter or concurrency controller, are marked with
+    ``request_sent = False``; anything else might have got through.
+    """
+    return getattr(error, 'request_sent', True)
+
+
+class RetryPolicy(object):
+    """Decides whether, and when, a failed call should be tried again.
+
+    Network errors, retryable HTTP statuses and faults whose
+    ``exception_type`` is in ``retryable_fault_types`` are retried up
+    to ``max_attempts`` attempts in total, waiting a random time of up
+    to ``base_delay * 2 ** n`` seconds (capped at ``max_delay``) before
+    the ``n``-th retry. No retry is started if it would finish after
+    the operation's ``deadline`` (in seconds from when the operation
+    started).
+
+    A network error or 5xx response may come after WebFaction has
+    already made a change, so calls to methods other than
+    ``safe_methods`` are only retried after them if the request was
+    never sent, or the status says it wasn't acted on.
+    """
+
+    def __init__(self, max_attempts=3, base_delay=0.1, max_delay=5.0,
+                 deadline=60.0, retryable_fault_types=RETRYABLE_FAULT_TYPES,
+                 safe_methods=SAFE_METHODS, clock=time.time,
+                 sleep=time.sleep, random=random.random):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.retryable_fault_types = (
+            frozenset(retryable_fault_types) - PERMANENT_FAULT_TYPES
+        )
+        self.safe_methods = frozenset(safe_methods)
+        self.clock = clock
+        self.sleep = sleep
+        self.random = random
+
+    def _is_safe(self, method):
+        return method is None or method in self.safe_methods
+
+    def is_retryable(self, error, method=None):
+        """Returns whether a call to ``method`` which failed with
+        ``error`` may be tried again. Without a ``method``, says
+        whether the error is a transient one at all.
+        """
+        if isinstance(error, WebFactionFault):
+            return error.exception_type in self.retryable_fault_types
+
+        if isinstance(error, xmlrpc_client.Fault):
+            return self.is_retryable(WebFactionFault(error))
+
+        if isinstance(error, xmlrpc_client.ProtocolError):
+            if error.errcode not in RETRYABLE_STATUSES:
+                return False
+
+            return (error.errcode in UNPROCESSED_STATUSES or
+                    self._is_safe(method))
+
+        if not isinstance(error, (socket.error, http_client.HTTPException)):
+            return False
+
+        return self._is_safe(method) or not request_sent(error)
+
+    def start(self):
+        """Returns the deadline for an operation starting now."""
+        if self.deadline is None:
+            return None
+
+        return self.clock() + self.deadline
+
+    def backoff(self, retry):
+        cap = min(self.max_delay, self.base_delay * (2 ** (retry - 1)))
+        return self.random() * cap
+
+    def delay(self, error, retry, deadline, method=None):
+        """Returns how long to wait before making retry number
+        ``retry`` of a call to ``method`` after ``error``, or ``None``
+        if the call shouldn't be retried.
+        """
+        if retry >= self.max_attempts:
+            return None
+
+        if not self.is_retryable(error, method):
+            return None
+
+        delay = self.backoff(retry)
+
+        if deadline is not None and self.clock() + delay >= deadline:
+            return None
+
+        return delay
+
+
+NO_RETRIES = RetryPolicy(max_attempts=1)
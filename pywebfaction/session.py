@@ -0,0 +1,90 @@
+import json
+import os
+import tempfile
+import threading
+import time
+
+
+DEFAULT_MAX_AGE = 3600
+
+
+class SessionCache(object):
+    """Stores WebFaction session ids on disk, keyed by username.
+
+    The cache file is only ever readable by its owner, since a session
+    id grants the same access to the account as its password. Sessions
+    older than ``max_age`` seconds are treated as expired. A cache can
+    be shared by several threads, e.g. logging in to several accounts
+    at once.
+    """
+
+    def __init__(self, filename, max_age=DEFAULT_MAX_AGE):
+        self.filename = filename
+        self.max_age = max_age
+        self._lock = threading.Lock()
+
+    def _read(self):
+        try:
+            with open(self.filename) as cachefile:
+                sessions = json.load(cachefile)
+        except (IOError, OSError, ValueError):
+            return {}
+
+        if not isinstance(sessions, dict):
+            return {}
+
+        return sessions
+
+    def _write(self, sessions):
+        # mkstemp creates a new file with a unique name, readable only
+        # by its owner, so there's no chance of reusing (and keeping the
+        # permissions of) an existing one.
+        directory, name = os.path.split(os.path.abspath(self.filename))
+        descriptor, temporary = tempfile.mkstemp(
+            prefix=name + '.',
+            suffix='.tmp',
+            dir=directory
+        )
+
+        try:
+            with os.fdopen(descriptor, 'w') as cachefile:
+                json.dump(sessions, cachefile)
+
+            os.rename(temporary, self.filename)
+        except Exception:
+            os.remove(temporary)
+            raise
+
+    def get(self, username):
+        with self._lock:
+            entry = self._read().get(username)
+
+        if not isinstance(entry, dict):
+            return None
+
+        try:
+            age = time.time() - entry['created']
+            session_id = entry['session_id']
+        except (KeyError, TypeError):
+            return None
+
+        if age > self.max_age:
+            return None
+
+        return session_id
+
+    def set(self, username, session_id):
+        with self._lock:
+            sessions = self._read()
+            sessions[username] = {
+                'session_id': session_id,
+                'created': time.time(),
+            }
+            self._write(sessions)
+
+    def clear(self, username):
+        with self._lock:
+            sessions = self._read()
+
+            if sessions.pop(username, None) is not None:
+                self._write(sessions)
@@ -0,0 +1,127 @@
+from xml.parsers import expat
+
+from pywebfaction.utils import Email
+from six.moves import xmlrpc_client
+
+
+# Depths of the elements we care about in a list_emails response:
+# methodResponse > params > param > value > array > data > value
+# > struct > member > name / value.
+RESPONSE_BODY_DEPTH = 2
+ENTRY_DEPTH = 7
+MEMBER_FIELD_DEPTH = 10
+
+EMAIL_FIELDS = ('email_address', 'targets')
+
+
+class EmailListParser(object):
+    """An incremental parser for ``list_emails`` responses.
+
+    Rather than unmarshalling the response into generic dictionaries
+    like ``xmlrpc_client`` does, this goes straight from the XML to
+    ``Email`` objects, and ignores any fields ``Email`` doesn't use.
+
+    Feed it the response a piece at a time with ``feed``; completed
+    ``Email`` objects collect in ``emails`` until the caller takes
+    them.
+    """
+
+    def __init__(self):
+        self.emails = []
+        self.is_fault = None
+        self._depth = 0
+        self._text = []
+        self._typed_text = None
+        self._name = None
+        self._fields = {}
+
+        self._parser = expat.ParserCreate()
+        self._parser.buffer_text = True
+        self._parser.StartElementHandler = self._start
+        self._parser.EndElementHandler = self._end
+
+    def feed(self, data):
+        self._parser.Parse(data, False)
+
+    def close(self):
+        self._parser.Parse(b'', True)
+
+    def _start(self, tag, attrs):
+        self._depth += 1
+
+        if self._depth >= MEMBER_FIELD_DEPTH:
+            if self._depth <= MEMBER_FIELD_DEPTH + 1:
+                self._text = []
+            # Text is only collected inside member names and values;
+            # leaving the handler unset elsewhere means expat doesn't
+            # call back into Python for the whitespace between tags.
+            self._parser.CharacterDataHandler = self._text.append
+        elif self._depth == RESPONSE_BODY_DEPTH and self.is_fault is None:
+            self.is_fault = tag == 'fault'
+
+    def _end(self, tag):
+        depth = self._depth
+        self._depth -= 1
+
+        if self.is_fault:
+            return
+
+        if depth == MEMBER_FIELD_DEPTH + 1:
+            # The text of a typed value, e.g. <string>...</string>.
+            self._typed_text = ''.join(self._text)
+        elif depth == MEMBER_FIELD_DEPTH:
+            self._parser.CharacterDataHandler = None
+            text = self._typed_text
+            if text is None:
+                text = ''.join(self._text)
+            self._typed_text = None
+
+            if tag == 'name':
+                self._name = text
+            elif self._name in EMAIL_FIELDS:
+                self._fields[self._name] = text
+        elif depth == ENTRY_DEPTH:
+            fields, self._fields = self._fields, {}
+            self.emails.append(Email.from_fields(
+                fields.get('email_address'),
+                fields.get('targets', ''),
+            ))
+
+
+def iter_email_response(chunks):
+    """Parses a ``list_emails`` response, yielding ``Email`` objects.
+
+    ``chunks`` is an iterable of pieces of the raw XML-RPC response.
+    Each ``Email`` is yielded as soon as its entry has been parsed, so
+    memory use doesn't grow with the size of the response. Faults are
+    raised as ``xmlrpc_client.Fault``.
+    """
+    parser = EmailListParser()
+    received = []
+
+    for chunk in chunks:
+        if parser.is_fault is not False:
+            received.append(chunk)
+
+        parser.feed(chunk)
+
+        if parser.emails:
+            emails, parser.emails = parser.emails, []
+            for email in emails:
+                yield email
+
+    parser.close()
+
+    for email in parser.emails:
+        yield email
+
+    if parser.is_fault:
+        # Faults are small, so let the standard library deal with them.
+        xmlrpc_client.loads(b''.join(received))
+
+
+def parse_email_response(data):
+    """Parses a complete ``list_emails`` response into a list of
+    ``Email`` objects.
+    """
+    return list(iter_email_response([data]))
@@ -0,0 +1,312 @@
+"""A fake WebFaction API server, for tests and load tests.
+
+``FakeWebFactionServer`` speaks XML-RPC like the real API, keeping its
+mailboxes and email addresses in memory, and fails in the same way -
+with faults whose strings ``WebFactionFault`` can parse. It implements
+``login``, ``list_emails``, ``list_mailboxes``, ``create_mailbox``,
+``delete_mailbox``, ``create_email``, ``update_email``,
+``delete_email`` and ``system.multicall``, serves each connection in
+its own thread, and can add latency, jitter and faults to calls::
+
+    from pywebfaction import WebFactionAPI
+    from pywebfaction.testing import FakeWebFactionServer
+
+    with FakeWebFactionServer(latency=0.05, fault_rate=0.01) as server:
+        api = WebFactionAPI('user', 'password', endpoint=server.endpoint)
+        api.create_email('me@example.com')
+"""
+import collections
+import itertools
+import random
+import threading
+import time
+
+from six.moves.socketserver import ThreadingMixIn
+from six.moves.xmlrpc_server import (
+    SimpleXMLRPCRequestHandler,
+    SimpleXMLRPCServer,
+)
+from six.moves import xmlrpc_client
+
+
+FAULT_FORMAT = "<class 'webfaction_api.exceptions.%s'>:[u'%s']"
+
+MAILBOX_EXISTS = 'Mailbox with this Name already exists.'
+EMAIL_EXISTS = 'Email with this Username and Subdomain already exists.'
+MAILBOX_NOT_FOUND = 'Mailbox matching query does not exist.'
+EMAIL_NOT_FOUND = 'Email matching query does not exist.'
+BAD_LOGIN = 'Invalid username or password.'
+BAD_SESSION = 'Session has expired.'
+INJECTED = 'Injected fault.'
+
+
+def fault(exception_type, message):
+    """Returns an ``xmlrpc_client.Fault`` like the ones WebFaction
+    raises, e.g. ``fault('DataError', MAILBOX_EXISTS)``.
+    """
+    return xmlrpc_client.Fault(1, FAULT_FORMAT % (exception_type, message))
+
+
+def sample_emails(count):
+    """Returns ``count`` made-up ``(address, targets)`` pairs, for
+    filling a server with a large listing.
+    """
+    return [
+        ('user%d@example.com' % i,
+         'user%d_examplecom,forward%d@example.org' % (i, i % 100))
+        for i in range(count)
+    ]
+
+
+def _password(mailbox):
+    return 'pw_' + mailbox
+
+
+class KeepAliveRequestHandler(SimpleXMLRPCRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+
+class FakeWebFactionServer(ThreadingMixIn, SimpleXMLRPCServer):
+    """An in-memory WebFaction API, listening on ``host`` and ``port``
+    (any free port by default - see ``endpoint``).
+
+    The state is kept in ``mailboxes``, which maps mailbox names to
+    passwords, and ``emails``, which maps email addresses to their
+    comma-separated targets, as WebFaction lists them. Both can be
+    filled in up front with ``mailboxes`` (names) and ``emails``
+    (a mapping, or ``(address, targets)`` pairs), or changed directly
+    while the server runs. ``calls`` counts calls to each method.
+
+    Every request waits ``latency`` seconds, plus a random time of up
+    to ``jitter`` seconds, before it's handled. A ``system.multicall``
+    is one request, so it only waits once, as it would over a real
+    network. Each call other than ``login`` fails with a
+    ``fault_type`` fault with probability ``fault_rate``; use
+    ``fail_next`` for faults which must happen. ``seed`` makes the
+    jitter and faults repeatable.
+
+    If ``users`` (a mapping of usernames to passwords) is given, only
+    they can log in; they all share the same mailboxes and emails.
+    Pass ``multicall=False`` for a server without
+    ``system.multicall``.
+    """
+
+    daemon_threads = True
+    request_queue_size = 128
+    # Subclasses can swap this to change how requests are handled.
+    request_handler = KeepAliveRequestHandler
+
+    def __init__(self, host='127.0.0.1', port=0, users=None, mailboxes=(),
+                 emails=(), latency=0.0, jitter=0.0, fault_rate=0.0,
+                 fault_type='ServerError', seed=None, multicall=True):
+        SimpleXMLRPCServer.__init__(
+            self,
+            (host, port),
+            requestHandler=self.request_handler,
+            logRequests=False,
+            allow_none=True,
+        )
+        self.users = users
+        self.latency = latency
+        self.jitter = jitter
+        self.fault_rate = fault_rate
+        self.fault_type = fault_type
+        self.random = random.Random(seed)
+        self.calls = collections.Counter()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+        self.lock = threading.Lock()
+        self.mailboxes = dict(
+            (mailbox, _password(mailbox)) for mailbox in mailboxes
+        )
+        self.emails = dict(emails)
+        self.sessions = set()
+        self._ids = {}
+        self._sessions = itertools.count(1)
+        self._pending_faults = collections.defaultdict(collections.deque)
+
+        if multicall:
+            self.register_multicall_functions()
+
+        for name in ('login', 'list_emails', 'list_mailboxes',
+                     'create_mailbox', 'delete_mailbox', 'create_email',
+                     'update_email', 'delete_email'):
+            self.register_function(getattr(self, name), name)
+
+    @property
+    def endpoint(self):
+        return 'http://%s:%d/' % self.server_address[:2]
+
+    def start(self):
+        """Starts serving in a background thread."""
+        thread = threading.Thread(
+            target=self.serve_forever,
+            kwargs={'poll_interval': 0.05}
+        )
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def fail_next(self, method, times=1, fault_type='ServerError',
+                  message=INJECTED):
+        """Makes the next ``times`` calls to ``method`` fail."""
+        with self.lock:
+            self._pending_faults[method].extend(
+                [fault(fault_type, message)] * times
+            )
+
+    def expire_sessions(self):
+        """Forgets every session, so clients have to log in again."""
+        with self.lock:
+            self.sessions.clear()
+
+    def _delay(self):
+        with self.lock:
+            delay = self.latency + self.random.uniform(0, self.jitter)
+
+        if delay > 0:
+            time.sleep(delay)
+
+    def _marshaled_dispatch(self, data, dispatch_method=None, path=None):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+        try:
+            self._delay()
+            return SimpleXMLRPCServer._marshaled_dispatch(
+                self, data, dispatch_method, path
+            )
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+    def _injected_fault(self, method):
+        with self.lock:
+            self.calls[method] += 1
+
+            if self._pending_faults[method]:
+                return self._pending_faults[method].popleft()
+
+            if (method != 'login' and self.fault_rate and
+                    self.random.random() < self.fault_rate):
+                return fault(self.fault_type, INJECTED)
+
+    def _dispatch(self, method, params):
+        # system.multicall dispatches each of its calls through here
+        # too, so they can fail one at a time, as they do on the real
+        # API.
+        if not method.startswith('system.'):
+            error = self._injected_fault(method)
+            if error is not None:
+                raise error
+
+        return SimpleXMLRPCServer._dispatch(self, method, params)
+
+    def _check_session(self, session_id):
+        # Callers hold the lock.
+        if session_id not in self.sessions:
+            raise fault('LoginError', BAD_SESSION)
+
+    def _id(self, kind, name):
+        # Callers hold the lock. Ids are handed out the first time an
+        # object is seen, however it was added, and kept for as long as
+        # the server runs.
+        ids = self._ids.setdefault(kind, {})
+
+        if name not in ids:
+            ids[name] = len(ids) + 1
+
+        return ids[name]
+
+    def login(self, username, password, *args):
+        if self.users is not None and self.users.get(username) != password:
+            raise fault('LoginError', BAD_LOGIN)
+
+        with self.lock:
+            session_id = 'session%d' % next(self._sessions)
+            self.sessions.add(session_id)
+
+        return [session_id, {'id': 1, 'username': username}]
+
+    def list_emails(self, session_id):
+        with self.lock:
+            self._check_session(session_id)
+            return [
+                {'id': self._id('email', address), 'email_address': address,
+                 'targets': targets}
+                for address, targets in sorted(self.emails.items())
+            ]
+
+    def list_mailboxes(self, session_id):
+        with self.lock:
+            self._check_session(session_id)
+            return [
+                {'id': self._id('mailbox', mailbox), 'mailbox': mailbox}
+                for mailbox in sorted(self.mailboxes)
+            ]
+
+    def create_mailbox(self, session_id, mailbox, *args):
+        with self.lock:
+            self._check_session(session_id)
+
+            if mailbox in self.mailboxes:
+                raise fault('DataError', MAILBOX_EXISTS)
+
+            self.mailboxes[mailbox] = _password(mailbox)
+            return {'id': self._id('mailbox', mailbox), 'mailbox': mailbox,
+                    'password': self.mailboxes[mailbox]}
+
+    def delete_mailbox(self, session_id, mailbox):
+        with self.lock:
+            self._check_session(session_id)
+
+            if self.mailboxes.pop(mailbox, None) is None:
+                raise fault('DataError', MAILBOX_NOT_FOUND)
+
+        return {}
+
+    def _email(self, address):
+        # Callers hold the lock.
+        return {'id': self._id('email', address), 'email_address': address,
+                'targets': self.emails[address]}
+
+    def create_email(self, session_id, address, targets, *args):
+        with self.lock:
+            self._check_session(session_id)
+
+            if address in self.emails:
+                raise fault('DataError', EMAIL_EXISTS)
+
+            self.emails[address] = targets
+            return self._email(address)
+
+    def update_email(self, session_id, address, targets, *args):
+        with self.lock:
+            self._check_session(session_id)
+
+            if address not in self.emails:
+                raise fault('DataError', EMAIL_NOT_FOUND)
+
+            self.emails[address] = targets
+            return self._email(address)
+
+    def delete_email(self, session_id, address):
+        with self.lock:
+            self._check_session(session_id)
+
+            if self.emails.pop(address, None) is None:
+                raise fault('DataError', EMAIL_NOT_FOUND)
+
+        return {}
@@ -0,0 +1,211 @@
+import socket
+import threading
+import time
+
+
+DEFAULT_INITIAL_CONCURRENCY = 8
+DEFAULT_MAX_CONCURRENCY = 64
+
+# Calls slower than this many times the average for their method are
+# taken as a sign the server is struggling...
+DEFAULT_LATENCY_FACTOR = 4.0
+# ...as long as they're slower than this (in seconds), so that jitter
+# on a fast connection isn't mistaken for overload.
+MIN_LATENCY_TARGET = 0.1
+# How much each call moves its method's average duration.
+LATENCY_SMOOTHING = 0.1
+
+
+def wait_timeout():
+    """Returns the ``socket.timeout`` for a call which gave up waiting
+    to be sent, marked (like errors raised while connecting) as never
+    having reached the server.
+    """
+    error = socket.timeout('timed out')
+    error.request_sent = False
+    return error
+
+
+class TokenBucket(object):
+    """Allows ``rate`` calls per second on average, with bursts of up
+    to ``burst`` calls.
+    """
+
+    def __init__(self, rate, burst=1, clock=time.time, sleep=time.sleep):
+        self.rate = float(rate)
+        self.burst = burst
+        self.clock = clock
+        self.sleep = sleep
+        self._tokens = float(burst)
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _reserve(self):
+        # Takes a token, possibly one which won't exist for a while,
+        # and returns how long to wait for it.
+        with self._lock:
+            now = self.clock()
+            self._tokens = min(
+                self.burst,
+                self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            self._tokens -= 1
+
+            if self._tokens >= 0:
+                return 0
+
+            return -self._tokens / self.rate
+
+    def acquire(self, timeout=None):
+        """Waits until a call is allowed. Raises ``socket.timeout``
+        straight away if that would take more than ``timeout`` seconds.
+        """
+        delay = self._reserve()
+
+        if timeout is not None and delay > max(timeout, 0):
+            # Hand back the token we won't be using.
+            with self._lock:
+                self._tokens += 1
+            raise wait_timeout()
+
+        if delay > 0:
+            self.sleep(delay)
+
+
+class RateLimiter(object):
+    """Limits calls to each API method with its own ``TokenBucket``.
+
+    ``limits`` maps method names to ``(rate, burst)`` pairs, and
+    ``default`` (if given) applies to every other method. A limiter
+    can be shared by several ``WebFactionAPI`` objects using the same
+    account.
+    """
+
+    def __init__(self, limits=None, default=None, clock=time.time,
+                 sleep=time.sleep):
+        self.limits = dict(limits or {})
+        self.default = default
+        self.clock = clock
+        self.sleep = sleep
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, method):
+        with self._lock:
+            if method not in self._buckets:
+                limit = self.limits.get(method, self.default)
+                self._buckets[method] = limit and TokenBucket(
+                    limit[0],
+                    limit[1],
+                    clock=self.clock,
+                    sleep=self.sleep
+                )
+
+            return self._buckets[method]
+
+    def acquire(self, method, timeout=None):
+        bucket = self._bucket(method)
+
+        if bucket is not None:
+            bucket.acquire(timeout)
+
+
+class AdaptiveConcurrency(object):
+    """Limits how many calls are in flight at once, adjusting the limit
+    AIMD-style: it grows by about one for each limit's worth of calls
+    which go well, and halves when a call fails in a way which suggests
+    the server is overloaded, or takes much longer than usual.
+
+    Calls are slow if they take longer than ``latency_target`` seconds
+    or, if that isn't given, ``latency_factor`` times the moving
+    average for the same method (and at least ``MIN_LATENCY_TARGET``),
+    so that methods which are always slow, like listing thousands of
+    emails, don't count against the others.
+    """
+
+    def __init__(self, initial=DEFAULT_INITIAL_CONCURRENCY, minimum=1,
+                 maximum=DEFAULT_MAX_CONCURRENCY, backoff=0.5,
+                 latency_target=None,
+                 latency_factor=DEFAULT_LATENCY_FACTOR):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.backoff = backoff
+        self.latency_target = latency_target
+        self.latency_factor = latency_factor
+        self._limit = float(initial)
+        self._in_flight = 0
+        self._baselines = {}
+        self._epoch = 0
+        self._condition = threading.Condition()
+
+    @property
+    def limit(self):
+        return max(self.minimum, int(self._limit))
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    def acquire(self, timeout=None):
+        """Waits for a free slot, and returns a ticket to hand back to
+        ``release``. Raises ``socket.timeout`` if there isn't one
+        within ``timeout`` seconds.
+        """
+        expires = None
+        if timeout is not None:
+            expires = time.time() + timeout
+
+        with self._condition:
+            while self._in_flight >= self.limit:
+                remaining = None
+                if expires is not None:
+                    remaining = expires - time.time()
+                    if remaining <= 0:
+                        raise wait_timeout()
+
+                self._condition.wait(remaining)
+
+            self._in_flight += 1
+            return self._epoch
+
+    def _is_slow(self, method, duration):
+        baseline = self._baselines.get(method)
+
+        if baseline is None:
+            self._baselines[method] = duration
+            return False
+
+        # Follow the average even when calls are slow, so that it
+        # catches up with a connection which has become slower for
+        # good.
+        self._baselines[method] = (
+            baseline + (duration - baseline) * LATENCY_SMOOTHING
+        )
+
+        target = self.latency_target
+        if target is None:
+            target = max(baseline * self.latency_factor, MIN_LATENCY_TARGET)
+
+        return duration > target
+
+    def release(self, ticket, duration, overloaded=False, method=None):
+        """Frees a slot, and adjusts the limit given how the call (to
+        ``method``) went.
+        """
+        with self._condition:
+            self._in_flight -= 1
+
+            if self._is_slow(method, duration) or overloaded:
+                # Calls which started before the last decrease were
+                # already counted in it, so don't decrease again for
+                # them.
+                if ticket == self._epoch:
+                    self._epoch += 1
+                    self._limit = max(self.minimum,
+                                      self._limit * self.backoff)
+            else:
+                self._limit = min(self.maximum,
+                                  self._limit + 1.0 / self.limit)
+
+            self._condition.notify_all()
@@ -0,0 +1,369 @@
+import socket
+import ssl
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+
+from six.moves import http_client, xmlrpc_client
+
+
+DEFAULT_POOL_SIZE = 4
+DEFAULT_IDLE_TIMEOUT = 30.0
+STREAM_CHUNK_SIZE = 16384
+
+# Request bodies at least this big are gzipped. Smaller ones gain
+# little, and cost the server a decompression.
+DEFAULT_ENCODE_THRESHOLD = 4096
+
+# The most a gzipped response may decompress to, as in the standard
+# library's gzip_decode. Anything bigger is probably a gzip bomb.
+DEFAULT_MAX_DECODED_SIZE = 20 * 1024 * 1024
+
+# Statuses a server might send if it can't read a gzipped request.
+ENCODING_REJECTED_STATUSES = (400, 415, 501)
+
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+class PooledTransport(xmlrpc_client.Transport):
+    """An XML-RPC transport which keeps persistent connections open.
+
+    Connections are checked out of a pool for the duration of a single
+    request and returned afterwards, so consecutive calls skip the TCP
+    and TLS handshakes. At most ``pool_size`` idle connections are kept
+    per host, and connections which have been idle for longer than
+    ``idle_timeout`` seconds are closed rather than reused.
+
+    If a reused connection turns out to have been closed by the
+    server, the request is retried once on a fresh connection.
+
+    A single SSL context is shared by every connection the transport
+    opens, since building one (and loading the system certificates)
+    costs about as much as the handshake itself.
+
+    ``connect_timeout`` limits how long opening a connection (including
+    the TLS handshake) may take, and ``read_timeout`` how long to wait
+    for each piece of the response. Both default to waiting forever,
+    and can be overridden for the current thread with ``timeouts``.
+
+    Unless ``accept_gzip_encoding`` is false, the server is told it may
+    gzip its responses, which are decompressed as they arrive; one
+    which decompresses to more than ``max_decoded_size`` bytes
+    (``None`` for no limit) raises ``ValueError``. Request
+    bodies of at least ``encode_threshold`` bytes are gzipped too
+    (``None`` turns this off); if the server rejects a gzipped request,
+    it's sent again uncompressed, and later requests aren't gzipped.
+    """
+
+    def __init__(self, use_https=True, pool_size=DEFAULT_POOL_SIZE,
+                 idle_timeout=DEFAULT_IDLE_TIMEOUT, context=None,
+                 connect_timeout=None, read_timeout=None,
+                 accept_gzip_encoding=True,
+                 encode_threshold=DEFAULT_ENCODE_THRESHOLD,
+                 max_decoded_size=DEFAULT_MAX_DECODED_SIZE):
+        xmlrpc_client.Transport.__init__(self)
+        self.use_https = use_https
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self.context = context
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.accept_gzip_encoding = accept_gzip_encoding
+        self.encode_threshold = encode_threshold
+        self.max_decoded_size = max_decoded_size
+        self._idle = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @property
+    def last_request_size(self):
+        """The size of the last request body sent by the current
+        thread, as sent (i.e. after any compression).
+        """
+        return getattr(self._local, 'request_size', None)
+
+    @property
+    def last_response_size(self):
+        """The size of the last response body received by the current
+        thread, as received (i.e. before any decompression).
+        """
+        return getattr(self._local, 'response_size', None)
+
+    @contextmanager
+    def timeouts(self, connect=None, read=None):
+        """Overrides the connect and read timeouts for requests made by
+        the current thread inside the ``with`` block.
+        """
+        previous = getattr(self._local, 'timeouts', None)
+        self._local.timeouts = (connect, read)
+
+        try:
+            yield
+        finally:
+            self._local.timeouts = previous
+
+    def _get_timeouts(self):
+        timeouts = getattr(self._local, 'timeouts', None)
+
+        if timeouts is None:
+            return self.connect_timeout, self.read_timeout
+
+        return timeouts
+
+    def _decoder(self, response):
+        encoding = response.getheader('Content-Encoding', '') or ''
+
+        if encoding.lower() == 'gzip':
+            return zlib.decompressobj(GZIP_WBITS)
+
+        return None
+
+    def _encode(self, request_body):
+        if (self.encode_threshold is None or
+                len(request_body) < self.encode_threshold):
+            return request_body, False
+
+        compressor = zlib.compressobj(6, zlib.DEFLATED, GZIP_WBITS)
+        return compressor.compress(request_body) + compressor.flush(), True
+
+    def _decompress(self, decoder, data, decoded_size):
+        # Decompresses the next piece of a response (or, given no data,
+        # whatever is left), which has decompressed to ``decoded_size``
+        # bytes so far.
+        limit = self.max_decoded_size
+
+        if not data:
+            data = decoder.flush()
+        elif limit is None:
+            data = decoder.decompress(data)
+        else:
+            # Stop as soon as we know the limit's been passed, rather
+            # than decompressing all of a (possibly huge) chunk.
+            data = decoder.decompress(data, limit - decoded_size + 1)
+
+        if limit is not None and decoded_size + len(data) > limit:
+            raise ValueError("max gzipped payload length exceeded")
+
+        return data
+
+    def _read(self, response):
+        # Yields the response body in chunks as they arrive,
+        # decompressing them if need be.
+        decoder = self._decoder(response)
+        decoded_size = 0
+        self._local.response_size = 0
+
+        while True:
+            chunk = response.read(STREAM_CHUNK_SIZE)
+            if not chunk:
+                break
+
+            self._local.response_size += len(chunk)
+
+            if decoder is not None:
+                chunk = self._decompress(decoder, chunk, decoded_size)
+                decoded_size += len(chunk)
+                if not chunk:
+                    continue
+
+            yield chunk
+
+        if decoder is not None:
+            chunk = self._decompress(decoder, b'', decoded_size)
+            if chunk:
+                yield chunk
+
+    def parse_response(self, response):
+        parser, unmarshaller = self.getparser()
+
+        for chunk in self._read(response):
+            parser.feed(chunk)
+
+        parser.close()
+        return unmarshaller.close()
+
+    def make_connection(self, host):
+        chost, _, _ = self.get_host_info(host)
+
+        if self.use_https:
+            if self.context is None:
+                self.context = ssl.create_default_context()
+
+            return http_client.HTTPSConnection(chost, context=self.context)
+
+        return http_client.HTTPConnection(chost)
+
+    def _acquire(self, host):
+        now = time.time()
+        expired = []
+
+        with self._lock:
+            idle = self._idle.get(host, [])
+
+            while idle and now - idle[0][1] > self.idle_timeout:
+                expired.append(idle.pop(0)[0])
+
+            connection = idle.pop()[0] if idle else None
+
+        for stale in expired:
+            stale.close()
+
+        if connection is not None:
+            return connection, True
+
+        return self.make_connection(host), False
+
+    def _release(self, host, connection):
+        with self._lock:
+            idle = self._idle.setdefault(host, [])
+
+            if len(idle) < self.pool_size:
+                idle.append((connection, time.time()))
+                return
+
+        connection.close()
+
+    def _send(self, connection, host, handler, request_body,
+              encoded=False):
+        _, extra_headers, _ = self.get_host_info(host)
+        connect_timeout, read_timeout = self._get_timeouts()
+
+        if connection.sock is None:
+            connection.timeout = connect_timeout
+
+            try:
+                connection.connect()
+            except Exception as e:
+                # Nothing has been sent, so the request is safe to
+                # retry whatever it does.
+                e.request_sent = False
+                raise
+
+        connection.sock.settimeout(read_timeout)
+
+        connection.putrequest('POST', handler, skip_accept_encoding=True)
+        connection.putheader('Content-Type', 'text/xml')
+        connection.putheader('User-Agent', self.user_agent)
+        connection.putheader('Content-Length', str(len(request_body)))
+
+        if self.accept_gzip_encoding:
+            connection.putheader('Accept-Encoding', 'gzip')
+
+        if encoded:
+            connection.putheader('Content-Encoding', 'gzip')
+
+        for key, value in extra_headers or ():
+            connection.putheader(key, value)
+
+        connection.endheaders(request_body)
+        return connection.getresponse()
+
+    def _open(self, host, handler, request_body, encoded=False):
+        connection, reused = self._acquire(host)
+
+        try:
+            return connection, self._send(
+                connection, host, handler, request_body, encoded
+            )
+        except socket.timeout:
+            connection.close()
+            raise
+        except (socket.error, http_client.HTTPException):
+            connection.close()
+            if not reused:
+                raise
+
+        connection = self.make_connection(host)
+
+        try:
+            return connection, self._send(
+                connection, host, handler, request_body, encoded
+            )
+        except Exception:
+            connection.close()
+            raise
+
+    def _post(self, host, handler, request_body):
+        body, encoded = self._encode(request_body)
+        self._local.request_size = len(body)
+        connection, response = self._open(host, handler, body, encoded)
+
+        if encoded and response.status in ENCODING_REJECTED_STATUSES:
+            # The server can't read gzipped requests, so stop sending
+            # them.
+            response.read()
+            connection.close()
+            self.encode_threshold = None
+            self._local.request_size = len(request_body)
+            connection, response = self._open(host, handler, request_body)
+
+        self._check_status(host, handler, connection, response)
+        return connection, response
+
+    def _check_status(self, host, handler, connection, response):
+        if response.status != 200:
+            response.read()
+            connection.close()
+            raise xmlrpc_client.ProtocolError(
+                host + handler,
+                response.status,
+                response.reason,
+                response.msg,
+            )
+
+    def request(self, host, handler, request_body, verbose=False):
+        self.verbose = verbose
+        connection, response = self._post(host, handler, request_body)
+
+        try:
+            return self.parse_response(response)
+        except xmlrpc_client.Fault:
+            # Faults are well-formed responses, so the connection is
+            # still usable.
+            raise
+        except Exception:
+            connection.close()
+            connection = None
+            raise
+        finally:
+            if connection is not None:
+                if response.will_close:
+                    connection.close()
+                else:
+                    self._release(host, connection)
+
+    def stream_request(self, host, handler, request_body):
+        """Sends a request, and yields the raw response body in chunks.
+
+        Unlike ``request``, the response isn't parsed, so callers can
+        start processing a large response before all of it has
+        arrived. A gzipped response is decompressed a chunk at a time.
+
+        The request is sent straight away, using the timeouts in force
+        when this is called, rather than when iteration starts.
+        """
+        connection, response = self._post(host, handler, request_body)
+        return self._iter_response(host, connection, response)
+
+    def _iter_response(self, host, connection, response):
+        complete = False
+
+        try:
+            for chunk in self._read(response):
+                yield chunk
+
+            complete = True
+        finally:
+            if complete and not response.will_close:
+                self._release(host, connection)
+            else:
+                connection.close()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+
+        for connections in idle.values():
+            for connection, _ in connections:
+                connection.close()
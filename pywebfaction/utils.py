@@ -1,21 +1,149 @@
+import json
+
+from six.moves import intern
+
+
 class Email(object):
-    def __init__(self, entry):
-        def is_mailbox(target):
-            return target.find('@') == -1
+    # Listings can be large, so emails use slots rather than a
+    # __dict__, and only split their targets when they're asked for.
+    __slots__ = ('address', 'targets', '_mailboxes', '_forwards_to')
 
+    def __init__(self, entry):
         self.address = entry['email_address']
-        targets = entry['targets'].split(',')
-        self.mailboxes = [e for e in targets
-                          if is_mailbox(e) and e]
-        self.forwards_to = [e for e in targets
-                            if not is_mailbox(e) and e]
+        self.targets = entry['targets']
+        self._mailboxes = None
+        self._forwards_to = None
+
+    @classmethod
+    def from_fields(cls, address, targets):
+        email = cls.__new__(cls)
+        email.address = address
+        email.targets = targets
+        email._mailboxes = None
+        email._forwards_to = None
+        return email
+
+    def _split_targets(self):
+        mailboxes = []
+        forwards_to = []
+
+        for target in self.targets.split(','):
+            if not target:
+                continue
+
+            if '@' in target:
+                forwards_to.append(target)
+            else:
+                # The same few mailboxes tend to turn up across many
+                # addresses, so share a single copy of each name.
+                mailboxes.append(intern(str(target)))
+
+        self._mailboxes = mailboxes
+        self._forwards_to = forwards_to
+
+    @property
+    def mailboxes(self):
+        if self._mailboxes is None:
+            self._split_targets()
+        return self._mailboxes
+
+    @property
+    def forwards_to(self):
+        if self._forwards_to is None:
+            self._split_targets()
+        return self._forwards_to
+
+    def _key(self):
+        return (self.address, tuple(self.mailboxes), tuple(self.forwards_to))
+
+    def __eq__(self, other):
+        if not isinstance(other, Email):
+            return NotImplemented
+
+        if self.address != other.address:
+            return False
+
+        return self.targets == other.targets or self._key() == other._key()
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+
+        if result is NotImplemented:
+            return result
+
+        return not result
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def __getstate__(self):
+        return (self.address, self.targets)
+
+    def __setstate__(self, state):
+        self.address, self.targets = state
+        self._mailboxes = None
+        self._forwards_to = None
+
+    def to_dict(self):
+        return {
+            'address': self.address,
+            'mailboxes': self.mailboxes,
+            'forwards_to': self.forwards_to,
+        }
+
+    def to_json(self):
+        return json.dumps(self.to_dict())
+
+    def __repr__(self):
+        return '<Email: %s>' % self.address
 
     def __str__(self):
         return self.address
 
 
 class EmailRequestResponse(object):
+    __slots__ = ('mailbox', 'password', 'email_id')
+
     def __init__(self, mailbox, password, email_id):
-        self.mailbox = mailbox
+        self.mailbox = intern(str(mailbox))
         self.password = password
         self.email_id = email_id
+
+    def _key(self):
+        return (self.mailbox, self.password, self.email_id)
+
+    def __eq__(self, other):
+        if not isinstance(other, EmailRequestResponse):
+            return NotImplemented
+
+        return self._key() == other._key()
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+
+        if result is NotImplemented:
+            return result
+
+        return not result
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def __getstate__(self):
+        return self._key()
+
+    def __setstate__(self, state):
+        self.mailbox, self.password, self.email_id = state
+
+    def to_dict(self):
+        return {
+            'mailbox': self.mailbox,
+            'password': self.password,
+            'email_id': self.email_id,
+        }
+
+    def to_json(self):
+        return json.dumps(self.to_dict())
+
+    def __repr__(self):
+        return '<EmailRequestResponse: %s>' % self.mailbox
@@ -0,0 +1,158 @@
+import socket
+import time
+
+from pywebfaction.exceptions import WebFactionFault
+from six.moves import http_client, xmlrpc_client
+
+
+ADDED = 'added'
+REMOVED = 'removed'
+CHANGED = 'changed'
+
+DEFAULT_MIN_INTERVAL = 15.0
+DEFAULT_MAX_INTERVAL = 600.0
+DEFAULT_BACKOFF = 2.0
+
+# Errors which a later poll may well not run into.
+POLL_ERRORS = (
+    WebFactionFault,
+    xmlrpc_client.Error,
+    socket.error,
+    http_client.HTTPException,
+)
+
+
+class EmailChange(object):
+    """An email address which was added, removed or changed between
+    two polls. ``email`` is the address's new ``Email``, or ``None`` if
+    it was removed.
+    """
+
+    __slots__ = ('kind', 'address', 'email')
+
+    def __init__(self, kind, address, email=None):
+        self.kind = kind
+        self.address = address
+        self.email = email
+
+    def to_dict(self):
+        result = {'change': self.kind, 'address': self.address}
+
+        if self.email is not None:
+            result.update(self.email.to_dict())
+
+        return result
+
+    def __repr__(self):
+        return '<EmailChange: %s %s>' % (self.kind, self.address)
+
+
+def _digest(email):
+    # The snapshot only needs to tell whether an entry has changed, so
+    # a hash of its targets is enough, and far smaller than the Email.
+    return hash(email.targets)
+
+
+def diff(snapshot, emails):
+    """Compares ``emails`` against a snapshot from an earlier call.
+
+    Returns the new snapshot and a list of ``EmailChange`` objects.
+    ``snapshot`` may be ``None`` for the first call, in which case
+    there's nothing to compare against, so only the snapshot is built.
+    ``emails`` can be any iterable, so entries are compared as they're
+    parsed, and only the changed ones are kept.
+    """
+    if snapshot is None:
+        return dict((email.address, _digest(email)) for email in emails), []
+
+    previous = snapshot
+    current = {}
+    changes = []
+    kept = 0
+
+    for email in emails:
+        digest = _digest(email)
+        current[email.address] = digest
+        old = previous.get(email.address)
+
+        if old is None:
+            changes.append(EmailChange(ADDED, email.address, email))
+            continue
+
+        kept += 1
+        if old != digest:
+            changes.append(EmailChange(CHANGED, email.address, email))
+
+    # Only look for removed addresses if some are missing.
+    if kept < len(previous):
+        changes.extend(
+            EmailChange(REMOVED, address)
+            for address in sorted(set(previous) - set(current))
+        )
+
+    return current, changes
+
+
+class Watcher(object):
+    """Polls an account's email addresses, reporting what changes.
+
+    The interval between polls starts at ``min_interval`` seconds.
+    Each poll which finds no changes multiplies it by ``backoff``, up
+    to ``max_interval``, and a poll which finds a change drops it back
+    to ``min_interval`` - so an account which rarely changes is rarely
+    polled, while a burst of changes is followed closely.
+
+    When iterating, a poll which fails with a fault or network error
+    is passed to ``on_error`` (if given) and backed off like a poll
+    which found nothing, rather than ending the iteration.
+    """
+
+    def __init__(self, api, min_interval=DEFAULT_MIN_INTERVAL,
+                 max_interval=DEFAULT_MAX_INTERVAL, backoff=DEFAULT_BACKOFF,
+                 sleep=time.sleep, on_error=None):
+        self.api = api
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.sleep = sleep
+        self.on_error = on_error
+        self.interval = min_interval
+        self.snapshot = None
+
+    def poll(self):
+        """Fetches the email addresses, and returns what has changed
+        since the last poll. The first poll only takes a snapshot, and
+        returns nothing.
+        """
+        first = self.snapshot is None
+        self.snapshot, changes = diff(self.snapshot, self.api.iter_emails())
+
+        if first:
+            return []
+
+        if changes:
+            self.interval = self.min_interval
+        else:
+            self._back_off()
+
+        return changes
+
+    def _back_off(self):
+        self.interval = min(self.interval * self.backoff, self.max_interval)
+
+    def __iter__(self):
+        """Polls forever, yielding each change as it's found."""
+        while True:
+            try:
+                changes = self.poll()
+            except POLL_ERRORS as e:
+                if self.on_error is not None:
+                    self.on_error(e)
+
+                self._back_off()
+                changes = []
+
+            for change in changes:
+                yield change
+
+            self.sleep(self.interval)
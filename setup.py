@@ -20,6 +20,15 @@ class PyTest(TestCommand):
 
 readme = open('README.rst').read()
 
+install_requires = [
+    "six>=1.5.0",
+    "tabulate",
+    "docopt",
+]
+
+if sys.version_info < (3, 2):
+    install_requires.append("futures")
+
 setup(
     name='pywebfaction',
     version='0.1.2',
@@ -48,11 +57,10 @@ setup(
             'pywebfaction = pywebfaction.cli:main',
         ],
     },
-    install_requires=[
-        "six>=1.5.0",
-        "tabulate",
-        "docopt",
-    ],
+    install_requires=install_requires,
+    extras_require={
+        'yaml': ['PyYAML'],
+    },
     tests_require=[
         "pytest==2.5.2",
         "httpretty==0.8.0",
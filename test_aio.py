@@ -0,0 +1,137 @@
+import asyncio
+import time
+
+import pytest
+
+from pywebfaction import WebFactionFault
+from pywebfaction.aio import AsyncWebFactionAPI
+from pywebfaction.testing import EMAIL_EXISTS, FakeWebFactionServer, fault
+from six.moves.xmlrpc_server import SimpleXMLRPCRequestHandler
+from test_pywebfaction import fake_server
+
+
+def test_async_list_emails(request):
+    server = fake_server(request, emails={
+        'bar@example.net': 'cheesebox,foo@example.org',
+    })
+
+    async def run():
+        api = AsyncWebFactionAPI('theuser', 'foobar',
+                                 endpoint=server.endpoint)
+        async with api:
+            assert api.session_id in server.sessions
+            return await asyncio.gather(
+                *[api.list_emails() for _ in range(5)]
+            )
+
+    for emails in asyncio.run(run()):
+        assert len(emails) == 1
+        assert emails[0].mailboxes == ['cheesebox']
+        assert emails[0].forwards_to == ['foo@example.org']
+
+
+def test_async_create_email_mailbox_exists_and_rolls_back(request):
+    server = fake_server(request, mailboxes=['foo_exampleorg'],
+                         emails={'foo@example.org': 'somewhere'})
+
+    async def run():
+        async with AsyncWebFactionAPI('theuser', 'foobar',
+                                      endpoint=server.endpoint) as api:
+            await api.create_email('foo@example.org')
+
+    with pytest.raises(WebFactionFault) as excinfo:
+        asyncio.run(run())
+
+    assert excinfo.value.exception_message == EMAIL_EXISTS
+    assert server.calls['delete_mailbox'] == 1
+    assert list(server.mailboxes) == ['foo_exampleorg']
+
+
+def test_async_create_email_forwarder(request):
+    server = fake_server(request)
+
+    async def run():
+        async with AsyncWebFactionAPI('theuser', 'foobar',
+                                      endpoint=server.endpoint) as api:
+            return await api.create_email_forwarder(
+                'foo@example.org',
+                ['test@example.com', 'bar@example.net']
+            )
+
+    assert asyncio.run(run()) == 1
+    assert server.emails == {
+        'foo@example.org': 'test@example.com,bar@example.net',
+    }
+
+
+def test_async_create_email_timeout_rolls_back(request):
+    class SlowServer(FakeWebFactionServer):
+        def create_email(self, *args):
+            time.sleep(1)
+            raise fault('DataError', 'Too slow.')
+
+    server = SlowServer().start()
+    request.addfinalizer(server.stop)
+
+    async def run():
+        async with AsyncWebFactionAPI('theuser', 'foobar',
+                                      endpoint=server.endpoint) as api:
+            with pytest.raises(asyncio.TimeoutError):
+                await api.create_email('foo@example.org', timeout=0.2)
+
+    asyncio.run(run())
+
+    assert server.mailboxes == {}
+
+
+def test_async_create_email_keeps_mailbox_if_email_may_exist(request):
+    class SlowServer(FakeWebFactionServer):
+        def create_email(self, *args):
+            result = FakeWebFactionServer.create_email(self, *args)
+            time.sleep(0.5)
+            return result
+
+    server = SlowServer().start()
+    request.addfinalizer(server.stop)
+
+    async def run():
+        async with AsyncWebFactionAPI('theuser', 'foobar',
+                                      endpoint=server.endpoint) as api:
+            with pytest.raises(asyncio.TimeoutError):
+                await api.create_email('foo@example.org', timeout=0.2)
+
+    asyncio.run(run())
+
+    assert server.emails == {'foo@example.org': 'foo_exampleorg'}
+    assert list(server.mailboxes) == ['foo_exampleorg']
+
+
+def test_async_expired_session_logs_in_once(request):
+    server = fake_server(request, emails={'a@example.com': 'a_box'})
+
+    async def run():
+        async with AsyncWebFactionAPI('theuser', 'foobar',
+                                      endpoint=server.endpoint) as api:
+            server.expire_sessions()
+            return await asyncio.gather(
+                *[api.list_emails() for _ in range(20)]
+            )
+
+    assert all(len(emails) == 1 for emails in asyncio.run(run()))
+    assert server.calls['login'] == 2
+
+
+def test_async_transport_closes_http_1_0_connections(request):
+    class HTTP10Server(FakeWebFactionServer):
+        request_handler = SimpleXMLRPCRequestHandler
+
+    server = HTTP10Server().start()
+    request.addfinalizer(server.stop)
+
+    async def run():
+        async with AsyncWebFactionAPI('theuser', 'foobar',
+                                      endpoint=server.endpoint) as api:
+            assert await api.list_emails() == []
+            return api.transport._idle
+
+    assert asyncio.run(run()) == []
@@ -1,14 +1,60 @@
 import httpretty
+import json
+import os
+import pickle
+import socket
+import subprocess
+import sys
 import pytest
+import threading
+import time
 from lxml import etree
 from six import StringIO
 from six import string_types
+from six.moves import xmlrpc_client
+from six.moves.xmlrpc_client import Fault
 from pywebfaction import (
     WebFactionAPI,
     WEBFACTION_API_ENDPOINT,
     email_to_mailbox_name,
+    email_to_mailbox_names,
     WebFactionFault
 )
+from pywebfaction.accounts import WebFactionAccounts
+from pywebfaction.cache import EmailDirectory
+from pywebfaction.metrics import CallCounter, CallEvent, LatencyHistogram
+from pywebfaction.reconcile import (
+    CREATE,
+    CREATE_MAILBOX,
+    DELETE,
+    UPDATE,
+    Change,
+    apply_changes,
+    parse_desired_state,
+    plan,
+)
+from pywebfaction.retry import RetryPolicy, request_sent
+from pywebfaction.session import SessionCache
+from pywebfaction.testing import (
+    EMAIL_EXISTS,
+    MAILBOX_EXISTS,
+    FakeWebFactionServer,
+    KeepAliveRequestHandler,
+    fault,
+    sample_emails,
+)
+from pywebfaction.streaming import (
+    iter_email_response,
+    parse_email_response,
+)
+from pywebfaction.throttle import (
+    AdaptiveConcurrency,
+    RateLimiter,
+    TokenBucket,
+)
+from pywebfaction.transport import PooledTransport
+from pywebfaction.utils import Email, EmailRequestResponse
+from pywebfaction.watch import ADDED, CHANGED, REMOVED, diff
 
 
 def get_response_value(item):
@@ -280,6 +326,8 @@ def test_create_email_forwarder_failure():
 @httpretty.activate
 def test_create_email():
     register_response(
+        # Response for list_mailboxes
+        generate_response([]),
         generate_response(
             {
                 'password': 'password1',
@@ -305,6 +353,8 @@ def test_create_email():
 @httpretty.activate
 def test_create_email_mailbox_exists_once():
     register_response(
+        # Response for list_mailboxes
+        generate_response([]),
         generate_fault_response(
             [
                 {
@@ -337,7 +387,7 @@ def test_create_email_mailbox_exists_once():
     assert response.email_id == 42
 
     requests = httpretty.httpretty.latest_requests
-    request = StringIO(requests[2].parsed_body)
+    request = StringIO(requests[3].parsed_body)
     tree = etree.parse(request)
     params = tree.xpath('/methodCall/params/param/value/string')
 
@@ -348,6 +398,8 @@ def test_create_email_mailbox_exists_once():
 @httpretty.activate
 def test_create_email_mailbox_exists_twice():
     register_response(
+        # Response for list_mailboxes
+        generate_response([]),
         generate_fault_response(
             [
                 {
@@ -390,7 +442,7 @@ def test_create_email_mailbox_exists_twice():
     assert response.email_id == 42
 
     requests = httpretty.httpretty.latest_requests
-    request = StringIO(requests[3].parsed_body)
+    request = StringIO(requests[4].parsed_body)
     tree = etree.parse(request)
     params = tree.xpath('/methodCall/params/param/value/string')
 
@@ -401,6 +453,8 @@ def test_create_email_mailbox_exists_twice():
 @httpretty.activate
 def test_create_email_mailbox_fails_repeatedly():
     register_response(
+        # Response for list_mailboxes
+        generate_response([]),
         generate_fault_response(
             [
                 {
@@ -426,6 +480,8 @@ def test_create_email_mailbox_fails_repeatedly():
 @httpretty.activate
 def test_create_email_address_exists():
     register_response(
+        # Response for list_mailboxes
+        generate_response([]),
         generate_response(
             {
                 'password': 'password1',
@@ -470,6 +526,8 @@ def test_create_email_address_exists():
 @httpretty.activate
 def test_create_email_address_exists_and_mailbox_deletion_fails():
     register_response(
+        # Response for list_mailboxes
+        generate_response([]),
         generate_response(
             {
                 'password': 'password1',
@@ -602,3 +660,1715 @@ def test_exception_parsing_message_is_an_empty_list():
 
     assert err.exception_type == 'DataError'
     assert err.exception_message is None
+
+
+def fake_server(request, **kwargs):
+    server = FakeWebFactionServer(**kwargs).start()
+    request.addfinalizer(server.stop)
+    return server
+
+
+def test_pooled_transport_reuses_connections(request):
+    server = fake_server(request)
+    transport = PooledTransport(use_https=False)
+    connections = []
+    make_connection = transport.make_connection
+
+    def counting_make_connection(host):
+        connections.append(host)
+        return make_connection(host)
+
+    transport.make_connection = counting_make_connection
+
+    api = WebFactionAPI('theuser', 'foobar', endpoint=server.endpoint,
+                        transport=transport)
+    for _ in range(3):
+        assert api.list_emails() == []
+
+    assert len(connections) == 1
+
+
+def test_pooled_transport_reconnects_on_stale_connection(request):
+    server = fake_server(request)
+    transport = PooledTransport(use_https=False)
+    api = WebFactionAPI('theuser', 'foobar', endpoint=server.endpoint,
+                        transport=transport)
+
+    # Simulate the server having dropped the idle connection.
+    for connections in transport._idle.values():
+        for connection, _ in connections:
+            connection.sock.close()
+
+    assert api.list_emails() == []
+
+
+def test_pooled_transport_evicts_idle_connections(request):
+    server = fake_server(request)
+    transport = PooledTransport(use_https=False, idle_timeout=0)
+    connections = []
+    make_connection = transport.make_connection
+
+    def counting_make_connection(host):
+        connections.append(host)
+        return make_connection(host)
+
+    transport.make_connection = counting_make_connection
+
+    api = WebFactionAPI('theuser', 'foobar', endpoint=server.endpoint,
+                        transport=transport)
+    time.sleep(0.01)
+    api.list_emails()
+
+    assert len(connections) == 2
+
+
+def test_session_cache_round_trip(tmpdir):
+    filename = str(tmpdir.join('sessions'))
+    cache = SessionCache(filename)
+
+    assert cache.get('theuser') is None
+
+    cache.set('theuser', 'thesession_id')
+    assert cache.get('theuser') == 'thesession_id'
+    assert cache.get('otheruser') is None
+    assert os.stat(filename).st_mode & 0o777 == 0o600
+
+    cache.clear('theuser')
+    assert cache.get('theuser') is None
+
+
+def test_session_cache_is_thread_safe(tmpdir):
+    cache = SessionCache(str(tmpdir.join('sessions')))
+    threads = [
+        threading.Thread(target=cache.set, args=('user%d' % i, str(i)))
+        for i in range(12)
+    ]
+
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert [cache.get('user%d' % i) for i in range(12)] == [
+        str(i) for i in range(12)
+    ]
+    assert tmpdir.listdir() == [tmpdir.join('sessions')]
+
+
+def test_accounts_share_a_session_cache(request, tmpdir):
+    server = fake_server(request)
+    accounts = WebFactionAccounts(
+        dict(('account%d' % i, ('user%d' % i, 'pw')) for i in range(12)),
+        endpoint=server.endpoint,
+        session_cache=SessionCache(str(tmpdir.join('sessions'))),
+    )
+
+    assert len(accounts.call('list_emails')) == 12
+    assert accounts.errors == {}
+
+
+def test_session_cache_expiry(tmpdir):
+    cache = SessionCache(str(tmpdir.join('sessions')), max_age=-1)
+    cache.set('theuser', 'thesession_id')
+
+    assert cache.get('theuser') is None
+
+
+def test_session_cache_skips_login(request, tmpdir):
+    server = fake_server(request)
+    server.sessions.add('cached_session')
+
+    cache = SessionCache(str(tmpdir.join('sessions')))
+    cache.set('theuser', 'cached_session')
+
+    api = WebFactionAPI('theuser', 'foobar', endpoint=server.endpoint,
+                        session_cache=cache)
+
+    assert api.session_id == 'cached_session'
+    assert api.list_emails() == []
+    assert server.calls['login'] == 0
+
+
+def test_session_cache_rejected_session_logs_in_again(request, tmpdir):
+    server = fake_server(request)
+
+    cache = SessionCache(str(tmpdir.join('sessions')))
+    cache.set('theuser', 'stale_session')
+
+    api = WebFactionAPI('theuser', 'foobar', endpoint=server.endpoint,
+                        session_cache=cache)
+
+    assert api.list_emails() == []
+    assert server.calls['login'] == 1
+    assert cache.get('theuser') == api.session_id != 'stale_session'
+
+
+def test_batch_multicall(request):
+    server = fake_server(request, emails={'taken@example.com': 'x@y.com'})
+    api = WebFactionAPI('theuser', 'foobar', endpoint=server.endpoint)
+    counter = CallCounter()
+    api.add_observer(counter)
+
+    with api.batch(chunk_size=2) as batch:
+        calls = [
+            batch.create_email_forwarder(address, ['me@example.com'])
+            for address in ['a@example.com', 'taken@example.com',
+                            'b@example.com']
+        ]
+
+    assert counter.calls == {'system.multicall': 2}
+    assert calls[0].result() == 1
+    assert calls[2].result() == 2
+    assert calls[1].fault.exception_type == 'DataError'
+
+    with pytest.raises(WebFactionFault):
+        calls[1].result()
+
+
+def test_batch_falls_back_without_multicall(request):
+    server = fake_server(request, multicall=False,
+                         emails={'taken@example.com': 'x@y.com'})
+    api = WebFactionAPI('theuser', 'foobar', endpoint=server.endpoint)
+
+    with api.batch() as batch:
+        first = batch.create_email_forwarder('a@example.com', ['x@y.com'])
+        second = batch.create_email_forwarder('taken@example.com',
+                                              ['x@y.com'])
+
+    assert not api.supports_multicall
+    assert first.result() == 1
+    assert second.fault.exception_message == EMAIL_EXISTS
+    assert server.calls['create_email'] == 2
+    assert sorted(server.emails) == ['a@example.com', 'taken@example.com']
+
+
+def test_batch_keeps_multicall_after_server_fault(request):
+    def multicall(calls):
+        raise fault('ServerError', 'Busy.')
+
+    server = fake_server(request)
+    server.register_function(multicall, 'system.multicall')
+    api = WebFactionAPI('theuser', 'foobar', endpoint=server.endpoint,
+                        retry_policy=RetryPolicy(max_attempts=1))
+
+    with api.batch() as batch:
+        call = batch.create_email_forwarder('a@example.com', ['x@y.com'])
+
+    assert api.supports_multicall
+    assert call.fault.exception_type == 'ServerError'
+
+
+def test_batch_result_before_send(request):
+    server = fake_server(request)
+    api = WebFactionAPI('theuser', 'foobar', endpoint=server.endpoint)
+
+    batch = api.batch()
+    call = batch.create_email_forwarder('a@example.com', ['x@y.com'])
+
+    with pytest.raises(RuntimeError):
+        call.result()
+
+    batch.send()
+    assert call.result() == 1
+
+
+def test_create_emails(request):
+    server = fake_server(request, mailboxes=['user0_examplecom'])
+    api = WebFactionAPI('theuser', 'foobar', endpoint=server.endpoint)
+
+    addresses = ['user%d@example.com' % i for i in range(20)]
+    results = dict(api.create_emails(addresses + ['*+@'], max_workers=4))
+
+    assert set(results) == set(addresses + ['*+@'])
+    assert isinstance(results['*+@'], ValueError)
+    assert results['user0@example.com'].mailbox == 'user0_examplecom1'
+    assert results['user5@example.com'].mailbox == 'user5_examplecom'
+    assert results['user5@example.com'].password == (
+        server.mailboxes['user5_examplecom']
+    )
+    assert len(server.emails) == 20
+
+
+def test_create_emails_reports_faults(request):
+    server = fake_server(request, emails={'taken@example.com': 'somewhere'})
+    api = WebFactionAPI('theuser', 'foobar', endpoint=server.endpoint)
+
+    results = dict(api.create_emails(
+        iter(['taken@example.com', 'free@example.com']),
+        max_workers=2
+    ))
+
+    assert results['free@example.com'].mailbox == 'free_examplecom'
+    assert results['taken@example.com'].exception_message == EMAIL_EXISTS
+    # The mailbox created for the failed address was rolled back.
+    assert set(server.mailboxes) == set(['free_examplecom'])
+
+
+def test_create_emails_reports_network_errors(request):
+    class SlowServer(FakeWebFactionServer):
+        def create_email(self, session_id, address, targets):
+            if address == 'slow@example.com':
+                time.sleep(0.5)
+            return FakeWebFactionServer.create_email(
+                self, session_id, address, targets
+            )
+
+    server = SlowServer().start()
+    request.addfinalizer(server.stop)
+    api = WebFactionAPI('theuser', 'foobar', endpoint=server.endpoint,
+                        read_timeout=0.2)
+
+    addresses = ['slow@example.com'] + [
+        'user%d@example.com' % i for i in range(10)
+    ]
+    results = dict(api.create_emails(addresses, max_workers=4))
+
+    assert set(results) == set(addresses)
+    assert isinstance(results['slow@example.com'], socket.timeout)
+    assert results['user3@example.com'].mailbox == 'user3_examplecom'
+
+
+def test_create_email_picks_free_mailbox_locally(request):
+    server = fake_server(
+        request,
+        mailboxes=['foo_exampleorg', 'foo_exampleorg1', 'foo_exampleorg2'],
+    )
+    api = WebFactionAPI('theuser', 'foobar', endpoint=server.endpoint)
+
+    assert api.create_email('foo@example.org').mailbox == 'foo_exampleorg3'
+    assert api.create_email('FOO@example.org.').mailbox == 'foo_exampleorg4'
+    # Neither address tried a name which was already taken.
+    assert server.calls['create_mailbox'] == 2
+
+
+def test_create_email_all_mailbox_names_taken(request):
+    server = fake_server(
+        request,
+        mailboxes=['foo_exampleorg'] + [
+            'foo_exampleorg%d' % i for i in range(1, 11)
+        ],
+    )
+    api = WebFactionAPI('theuser', 'foobar', endpoint=server.endpoint)
+
+    with pytest.raises(WebFactionFault) as excinfo:
+        api.create_email('foo@example.org')
+
+    assert excinfo.value.exception_message == MAILBOX_EXISTS
+
+
+def test_create_email_refreshes_stale_mailbox_names(request):
+    server = fake_server(
+        request,
+        mailboxes=['foo_exampleorg'] + [
+            'foo_exampleorg%d' % i for i in range(1, 11)
+        ],
+    )
+    api = WebFactionAPI('theuser', 'foobar', endpoint=server.endpoint)
+    api.list_mailboxes()
+
+    # Freed by someone else, after we listed the mailboxes.
+    del server.mailboxes['foo_exampleorg3']
+
+    assert api.create_email('foo@example.org').mailbox == 'foo_exampleorg3'
+    assert server.calls['list_mailboxes'] == 2
+    assert server.calls['create_mailbox'] == 1
+
+
+def test_iter_email_response_in_small_chunks():
+    response = generate_response(
+        [
+            {
+                'targets': ',foo@example.com',
+                'email_address': 'foo@example.net',
+                'id': 72,
+            },
+            {
+                'targets': 'cheesebox,foo@example.org',
+                'email_address': 'bar&amp;baz@example.net',
+                'id': 73,
+            }
+        ]
+    ).encode('utf-8')
+
+    chunks = [response[i:i + 7] for i in range(0, len(response), 7)]
+    emails = list(iter_email_response(chunks))
+
+    assert [e.address for e in emails] == [
+        'foo@example.net',
+        'bar&baz@example.net',
+    ]
+    assert emails[0].forwards_to == ['foo@example.com']
+    assert emails[1].mailboxes == ['cheesebox']
+
+
+def test_iter_email_response_fault():
+    response = generate_fault_response(
+        [
+            {
+                'faultCode': 1,
+                'faultString': ("&lt;class \'webfaction_api.exceptions."
+                                "DataError\'&gt;:[u\'Nope.\']"),
+            },
+        ]
+    ).encode('utf-8')
+
+    with pytest.raises(Fault):
+        list(iter_email_response([response[:20], response[20:]]))
+
+
+def test_iter_emails(request):
+    server = fake_server(request, emails=[
+        ('user%d@example.com' % i, 'user%d,fwd@example.org' % i)
+        for i in range(50)
+    ])
+    api = WebFactionAPI('theuser', 'foobar', endpoint=server.endpoint)
+    streamed = list(api.iter_emails())
+
+    assert len(streamed) == 50
+    assert streamed[0].address == 'user0@example.com'
+    assert streamed[0].mailboxes == ['user0']
+    assert streamed[0].forwards_to == ['fwd@example.org']
+
+    # The connection goes back to the pool afterwards.
+    assert api.list_emails()[0].address == 'user0@example.com'
+
+
+def test_iter_emails_failure(request):
+    server = fake_server(request)
+    server.fail_next('list_emails', fault_type='DataError',
+                     message="We don\\'t want to give you that.")
+    api = WebFactionAPI('theuser', 'foobar', endpoint=server.endpoint)
+
+    with pytest.raises(WebFactionFault) as excinfo:
+        list(api.iter_emails())
+
+    assert excinfo.value.exception_message == (
+        "We don't want to give you that."
+    )
+
+
+def test_email_splits_targets_lazily():
+    email = Email({
+        'email_address': 'foo@example.net',
+        'targets': 'cheesebox,,foo@example.org',
+    })
+
+    assert not hasattr(email, '__dict__')
+    assert email._mailboxes is None
+    assert email.mailboxes == ['cheesebox']
+    assert email.forwards_to == ['foo@example.org']
+    assert str(email) == 'foo@example.net'
+
+
+def test_email_shares_mailbox_names():
+    first = Email({'email_address': 'a@example.net', 'targets': 'box' + 'x'})
+    second = Email({'email_address': 'b@example.net', 'targets': 'boxx'})
+
+    assert first.mailboxes[0] is second.mailboxes[0]
+
+
+def test_email_equality_and_hashing():
+    first = Email({'email_address': 'a@example.net',
+                   'targets': ',box,fwd@example.org'})
+    second = Email({'email_address': 'a@example.net',
+                    'targets': 'box,fwd@example.org'})
+    third = Email({'email_address': 'b@example.net',
+                   'targets': 'box,fwd@example.org'})
+
+    assert first == second
+    assert first != third
+    assert len(set([first, second, third])) == 2
+
+
+def test_email_serialization():
+    email = Email({'email_address': 'a@example.net',
+                   'targets': 'box,fwd@example.org'})
+
+    assert email.to_dict() == {
+        'address': 'a@example.net',
+        'mailboxes': ['box'],
+        'forwards_to': ['fwd@example.org'],
+    }
+    assert json.loads(email.to_json()) == email.to_dict()
+    assert pickle.loads(pickle.dumps(email)) == email
+
+
+def test_email_request_response():
+    response = EmailRequestResponse('box', 'secret', 42)
+
+    assert not hasattr(response, '__dict__')
+    assert response == EmailRequestResponse('box', 'secret', 42)
+    assert response != EmailRequestResponse('box', 'secret', 43)
+    assert response.to_dict() == {
+        'mailbox': 'box',
+        'password': 'secret',
+        'email_id': 42,
+    }
+    assert pickle.loads(pickle.dumps(response)) == response
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def directory_server(request):
+    server = fake_server(request, emails={
+        'foo@example.net': 'foobox,fwd@example.org',
+        'bar@example.net': 'fwd@example.org',
+    })
+    return server, WebFactionAPI('theuser', 'foobar',
+                                 endpoint=server.endpoint)
+
+
+def test_email_directory_lookups(request):
+    server, api = directory_server(request)
+    directory = EmailDirectory(api)
+
+    assert 'foo@example.net' in directory
+    assert 'nobody@example.net' not in directory
+    assert directory.get('bar@example.net').forwards_to == [
+        'fwd@example.org'
+    ]
+    assert [e.address for e in directory.by_mailbox('foobox')] == [
+        'foo@example.net'
+    ]
+    assert [e.address for e in directory.forwarding_to('fwd@example.org')] \
+        == ['bar@example.net', 'foo@example.net']
+    assert len(directory) == 2
+    assert server.calls['list_emails'] == 1
+
+
+def test_email_directory_handles_repeated_targets(request):
+    server, api = directory_server(request)
+    email = Email({
+        'email_address': 'dup@example.net',
+        'targets': 'dupbox,dupbox,x@example.org,x@example.org',
+    })
+    # A listing which repeats an address adds it twice.
+    api.iter_emails = lambda: iter([email, email])
+    directory = EmailDirectory(api)
+
+    assert [e.address for e in directory.by_mailbox('dupbox')] == [
+        'dup@example.net'
+    ]
+    assert [e.address for e in directory.forwarding_to('x@example.org')] == [
+        'dup@example.net'
+    ]
+
+
+def test_email_directory_expires(request):
+    server, api = directory_server(request)
+    clock = FakeClock()
+    directory = EmailDirectory(api, ttl=10, clock=clock)
+
+    assert 'new@example.net' not in directory
+
+    server.emails['new@example.net'] = 'fwd@example.org'
+    clock.now = 5
+    assert 'new@example.net' not in directory
+
+    clock.now = 11
+    assert 'new@example.net' in directory
+    assert server.calls['list_emails'] == 2
+
+
+def test_email_directory_write_through(request):
+    server, api = directory_server(request)
+    directory = EmailDirectory(api)
+    len(directory)
+
+    directory.create_email_forwarder('new@example.net', ['fwd@example.org'])
+    response = directory.create_email('boxed@example.net')
+
+    assert 'new@example.net' in directory
+    assert [e.address for e in directory.by_mailbox(response.mailbox)] == [
+        'boxed@example.net'
+    ]
+    assert len(directory.forwarding_to('fwd@example.org')) == 3
+    assert server.calls['list_emails'] == 1
+
+
+def test_email_to_mailbox_non_ascii_dropped():
+    result = email_to_mailbox_name(u'f\xf6o@example.org')
+    assert result == 'fo_exampleorg'
+
+
+def test_email_to_mailbox_names_resolves_collisions():
+    result = email_to_mailbox_names(
+        [
+            'foo@example.org',
+            'FOO@example.org',
+            'foo1@example.org',
+            'foo@example.org',
+            'bar@example.org',
+        ],
+        taken=['bar_exampleorg'],
+    )
+
+    assert result == [
+        'foo_exampleorg',
+        'foo_exampleorg1',
+        'foo1_exampleorg',
+        'foo_exampleorg2',
+        'bar_exampleorg1',
+    ]
+
+
+def test_email_to_mailbox_names_invalid():
+    with pytest.raises(ValueError):
+        email_to_mailbox_names(['foo@example.org', '*+@'])
+
+
+def test_parse_email_response_matches_stdlib():
+    entries = [
+        {
+            'targets': 'box%d,fwd@example.org' % i,
+            'email_address': 'user%d@example.net' % i,
+            'id': i,
+        }
+        for i in range(20)
+    ]
+    data = xmlrpc_client.dumps((entries, ), methodresponse=True)
+    expected = [Email(entry) for entry in xmlrpc_client.loads(data)[0][0]]
+
+    assert parse_email_response(data.encode('utf-8')) == expected
+
+
+def test_parse_email_response_untyped_values():
+    data = b"""<?xml version='1.0'?>
+    <methodResponse><params><param><value><array><data>
+    <value><struct>
+      <member><name>email_address</name>
+        <value>foo@example.net</value></member>
+      <member><name>targets</name>
+        <value>
+          <string>box</string>
+        </value></member>
+    </struct></value>
+    </data></array></value></param></params></methodResponse>"""
+
+    emails = parse_email_response(data)
+
+    assert len(emails) == 1
+    assert emails[0].address == 'foo@example.net'
+    assert emails[0].mailboxes == ['box']
+
+
+def test_observers_see_every_call(request):
+    server = fake_server(request, emails={'foo@example.org': 'box'})
+
+    events = []
+    counter = CallCounter()
+    histogram = LatencyHistogram()
+    api = WebFactionAPI('theuser', 'foobar', endpoint=server.endpoint,
+                        observers=[events.append, counter, histogram])
+
+    api.list_emails()
+    with pytest.raises(WebFactionFault):
+        api.create_email_forwarder('foo@example.org', ['x@example.com'])
+
+    assert [e.method for e in events] == [
+        'login', 'list_emails', 'create_email'
+    ]
+    assert all(e.request_bytes > 0 for e in events)
+    assert all(e.response_bytes > 0 for e in events)
+    assert events[2].fault_type == 'DataError'
+    assert events[2].failed
+    assert not events[1].failed
+
+    assert counter.calls == {
+        'login': 1, 'list_emails': 1, 'create_email': 1
+    }
+    assert counter.failures == {'create_email': 1}
+    assert counter.faults == {('create_email', 'DataError'): 1}
+    assert counter.response_bytes['list_emails'] == events[1].response_bytes
+
+    assert histogram.count('list_emails') == 1
+    assert histogram.percentile('list_emails', 0.99) is not None
+    assert histogram.methods() == ['create_email', 'list_emails', 'login']
+
+
+def test_observers_see_streamed_faults_and_retries(request, tmpdir):
+    server = fake_server(request)
+
+    cache = SessionCache(str(tmpdir.join('sessions')))
+    cache.set('theuser', 'stale_session')
+
+    events = []
+    api = WebFactionAPI('theuser', 'foobar', endpoint=server.endpoint,
+                        session_cache=cache, observers=[events.append])
+    list(api.iter_emails())
+
+    assert [(e.method, e.retries, e.fault_type) for e in events] == [
+        ('list_emails', 0, 'LoginError'),
+        ('login', 0, None),
+        ('list_emails', 1, None),
+    ]
+
+
+def test_latency_histogram_buckets():
+    histogram = LatencyHistogram(buckets=(0.1, 1.0))
+
+    for duration in (0.05, 0.05, 0.5, 5.0):
+        histogram(CallEvent('list_emails', duration))
+
+    assert histogram.counts('list_emails') == [(0.1, 2), (1.0, 1), (None, 1)]
+    assert histogram.percentile('list_emails', 0.5) == 0.1
+    assert histogram.percentile('list_emails', 0.75) == 1.0
+    assert histogram.percentile('list_emails', 1.0) is None
+    assert abs(histogram.mean('list_emails') - 1.4) < 1e-9
+    assert histogram.mean('login') is None
+
+
+def flaky_server(request, failures, fault_type='ServerError'):
+    server = fake_server(request, emails={'foo@example.net': 'box'})
+    server.fail_next('list_emails', times=failures, fault_type=fault_type)
+    return server
+
+
+def test_retry_retryable_faults(request):
+    server = flaky_server(request, failures=2)
+    sleeps = []
+    events = []
+    api = WebFactionAPI(
+        'theuser', 'foobar', endpoint=server.endpoint,
+        retry_policy=RetryPolicy(sleep=sleeps.append, random=lambda: 1.0),
+        observers=[events.append],
+    )
+
+    assert len(api.list_emails()) == 1
+    assert server.calls['list_emails'] == 3
+    assert sleeps == [0.1, 0.2]
+    assert [e.retries for e in events if e.method == 'list_emails'] == [
+        0, 1, 2
+    ]
+
+
+def test_retry_gives_up_after_max_attempts(request):
+    server = flaky_server(request, failures=5)
+    api = WebFactionAPI(
+        'theuser', 'foobar', endpoint=server.endpoint,
+        retry_policy=RetryPolicy(max_attempts=2, sleep=lambda delay: None),
+    )
+
+    with pytest.raises(WebFactionFault) as excinfo:
+        api.list_emails()
+
+    assert excinfo.value.exception_type == 'ServerError'
+    assert server.calls['list_emails'] == 2
+
+
+def test_retry_never_retries_permanent_faults(request):
+    server = flaky_server(request, failures=1, fault_type='DataError')
+    api = WebFactionAPI(
+        'theuser', 'foobar', endpoint=server.endpoint,
+        retry_policy=RetryPolicy(
+            retryable_fault_types=['DataError', 'ServerError'],
+            sleep=lambda delay: None,
+        ),
+    )
+
+    with pytest.raises(WebFactionFault):
+        api.list_emails()
+
+    assert server.calls['list_emails'] == 1
+
+
+def test_retry_respects_deadline(request):
+    server = flaky_server(request, failures=1)
+    ticks = iter(range(0, 1000, 5))
+    api = WebFactionAPI(
+        'theuser', 'foobar', endpoint=server.endpoint,
+        retry_policy=RetryPolicy(deadline=1.0, clock=lambda: next(ticks),
+                                 sleep=lambda delay: None),
+    )
+
+    with pytest.raises(WebFactionFault):
+        api.list_emails()
+
+    assert server.calls['list_emails'] == 1
+
+
+def test_retry_network_errors():
+    class FlakyTransport(xmlrpc_client.Transport):
+        attempts = 0
+
+        def request(self, host, handler, request_body, verbose=False):
+            self.attempts += 1
+            if self.attempts == 2:
+                raise socket.error('Connection reset by peer')
+            return (['thesession_id', {}], )
+
+    transport = FlakyTransport()
+    api = WebFactionAPI(
+        'theuser', 'foobar', transport=transport,
+        retry_policy=RetryPolicy(sleep=lambda delay: None),
+    )
+    api.login()
+
+    assert transport.attempts == 3
+
+
+def test_retry_policy_classification():
+    policy = RetryPolicy()
+
+    assert policy.is_retryable(socket.timeout())
+    assert policy.is_retryable(
+        xmlrpc_client.ProtocolError('host/', 503, 'Unavailable', {})
+    )
+    assert not policy.is_retryable(
+        xmlrpc_client.ProtocolError('host/', 404, 'Not Found', {})
+    )
+    assert not policy.is_retryable(ValueError())
+    assert not RetryPolicy(
+        retryable_fault_types=['ValidationError']
+    ).is_retryable(fault('ValidationError', 'No.'))
+
+
+def test_retry_policy_only_retries_safe_methods_after_network_errors():
+    policy = RetryPolicy()
+    refused = socket.error('Connection refused')
+    refused.request_sent = False
+
+    assert policy.is_retryable(socket.timeout(), 'list_emails')
+    assert not policy.is_retryable(socket.timeout(), 'create_email')
+    assert policy.is_retryable(refused, 'create_email')
+    assert policy.is_retryable(
+        xmlrpc_client.ProtocolError('host/', 503, 'Unavailable', {}),
+        'create_email'
+    )
+    assert not policy.is_retryable(
+        xmlrpc_client.ProtocolError('host/', 504, 'Gateway Timeout', {}),
+        'system.multicall'
+    )
+
+
+def test_create_email_keeps_mailbox_if_email_may_exist(request):
+    class SlowServer(FakeWebFactionServer):
+        def create_email(self, *args):
+            result = FakeWebFactionServer.create_email(self, *args)
+            time.sleep(0.5)
+            return result
+
+    server = SlowServer().start()
+    request.addfinalizer(server.stop)
+    api = WebFactionAPI('theuser', 'foobar', endpoint=server.endpoint,
+                        read_timeout=0.2)
+
+    with pytest.raises(socket.timeout):
+        api.create_email('me@example.com')
+
+    assert server.calls['create_email'] == 1
+    assert server.emails['me@example.com'] == 'me_examplecom'
+    assert list(server.mailboxes) == ['me_examplecom']
+
+
+def test_retry_policy_backoff_is_capped():
+    policy = RetryPolicy(base_delay=1.0, max_delay=3.0, random=lambda: 1.0)
+
+    assert [policy.backoff(n) for n in range(1, 5)] == [1.0, 2.0, 3.0, 3.0]
+
+
+def test_pooled_transport_read_timeout(request):
+    server = fake_server(request, latency=1)
+    server.sessions.add('thesession_id')
+    transport = PooledTransport(use_https=False, read_timeout=0.1)
+    body = xmlrpc_client.dumps(('thesession_id', ), 'list_emails').encode()
+    host = server.endpoint.split('/')[2]
+
+    start = time.time()
+    with pytest.raises(socket.timeout):
+        transport.request(host, '/', body)
+    assert time.time() - start < 0.5
+
+    with transport.timeouts(read=5):
+        assert transport.request(host, '/', body) == ([], )
+
+
+def test_list_emails_timeout(request):
+    server = flaky_server(request, failures=0)
+    api = WebFactionAPI('theuser', 'foobar', endpoint=server.endpoint,
+                        read_timeout=0.1)
+
+    assert len(api.list_emails()) == 1
+
+    api = WebFactionAPI('theuser', 'foobar', endpoint=server.endpoint)
+    server.latency = 1
+
+    start = time.time()
+    with pytest.raises(socket.timeout):
+        api.list_emails(timeout=0.2)
+    assert time.time() - start < 0.6
+
+
+def test_create_email_timeout_rolls_back(request):
+    class SlowServer(FakeWebFactionServer):
+        def create_email(self, *args):
+            time.sleep(1)
+
+    server = SlowServer().start()
+    request.addfinalizer(server.stop)
+    api = WebFactionAPI('theuser', 'foobar', endpoint=server.endpoint)
+
+    with pytest.raises(socket.timeout):
+        api.create_email('foo@example.org', timeout=0.2)
+
+    assert server.mailboxes == {}
+    assert api._mailbox_names == set()
+
+
+# How long importing the command-line tool may take, in seconds.
+CLI_IMPORT_BUDGET = 0.05
+
+
+@pytest.mark.skipif(sys.version_info < (3, 7),
+                    reason="-X importtime needs Python 3.7")
+def test_cli_imports_lazily():
+    best = None
+
+    for _ in range(3):
+        output = subprocess.check_output(
+            [sys.executable, '-X', 'importtime', '-c',
+             'import pywebfaction.cli'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.STDOUT,
+        ).decode('utf-8')
+        times = dict(
+            (name.strip(), int(cumulative))
+            for _, cumulative, name in (
+                line.split('|') for line in output.splitlines()
+                if line.startswith('import time:')
+                and 'cumulative' not in line
+            )
+        )
+
+        for module in ('docopt', 'pywebfaction.api', 'tabulate',
+                       'xmlrpc.client'):
+            assert module not in times
+
+        duration = times['pywebfaction.cli'] / 1e6
+        best = duration if best is None else min(best, duration)
+
+    assert best < CLI_IMPORT_BUDGET
+
+
+def test_cli_help_and_version(capsys):
+    from pywebfaction import cli
+
+    cli.main(['--help'])
+    assert capsys.readouterr()[0].startswith('pywebfaction\n\nUsage:')
+
+    cli.main(['--version'])
+    assert capsys.readouterr()[0] == 'pywebfaction 0.1.2\n'
+
+
+def test_package_exports_are_lazy():
+    import pywebfaction
+    from pywebfaction.api import WebFactionAPI as api_class
+
+    assert pywebfaction.WebFactionAPI is api_class
+    assert 'WebFactionAPI' in dir(pywebfaction)
+
+    with pytest.raises(AttributeError):
+        pywebfaction.NotAThing
+
+
+def test_create_email_forwarders(request):
+    server = fake_server(request)
+    api = WebFactionAPI('theuser', 'foobar', endpoint=server.endpoint)
+
+    results = dict(api.create_email_forwarders(
+        [
+            ('a@example.com', ['x@example.org']),
+            ('b@example.com', ['x@example.org', 'y@example.org']),
+            ('c@example.com', []),
+        ],
+        max_workers=2,
+    ))
+
+    assert server.emails == {
+        'a@example.com': 'x@example.org',
+        'b@example.com': 'x@example.org,y@example.org',
+    }
+    assert isinstance(results['a@example.com'], int)
+    assert isinstance(results['c@example.com'], ValueError)
+
+
+def test_cli_bulk_create(request, tmpdir, monkeypatch, capsys):
+    from pywebfaction import cli
+
+    server = fake_server(request)
+    monkeypatch.setattr(
+        cli,
+        'get_handle',
+        lambda: WebFactionAPI('theuser', 'foobar', endpoint=server.endpoint)
+    )
+    addresses = tmpdir.join('addresses.csv')
+    addresses.write('a@example.com\n\nb@example.com, ignored\n')
+
+    assert cli.main(['bulk_create', str(addresses), '--workers=2']) == 0
+
+    lines = sorted(
+        (json.loads(line) for line in capsys.readouterr()[0].splitlines()),
+        key=lambda line: line['address']
+    )
+    assert [line['address'] for line in lines] == [
+        'a@example.com', 'b@example.com'
+    ]
+    assert lines[0]['mailbox'] == 'a_examplecom'
+    assert lines[0]['password'] == server.mailboxes['a_examplecom']
+    assert sorted(server.emails) == ['a@example.com', 'b@example.com']
+
+
+def test_cli_bulk_forward_from_stdin(request, monkeypatch, capsys):
+    from pywebfaction import cli
+
+    server = fake_server(request)
+    monkeypatch.setattr(
+        cli,
+        'get_handle',
+        lambda: WebFactionAPI('theuser', 'foobar', endpoint=server.endpoint)
+    )
+    monkeypatch.setattr(sys, 'stdin', StringIO(
+        'a@example.com,x@example.org,y@example.org\n'
+        'b@example.com\n'
+    ))
+
+    assert cli.main(['bulk_forward']) == 1
+
+    lines = dict(
+        (line['address'], line) for line in (
+            json.loads(line) for line in capsys.readouterr()[0].splitlines()
+        )
+    )
+    assert 'email_id' in lines['a@example.com']
+    assert lines['b@example.com']['error'] == (
+        'Forwarders need at least one address.'
+    )
+    assert server.emails == {'a@example.com': 'x@example.org,y@example.org'}
+
+
+@pytest.mark.parametrize(('output_format', 'expected'), [
+    ('jsonl', [
+        '{"address": "a@example.com", "mailboxes": ["a_box"], '
+        '"forwards_to": []}',
+        '{"address": "b@example.com", "mailboxes": [], '
+        '"forwards_to": ["x@example.org", "y@example.org"]}',
+    ]),
+    ('csv', [
+        'Email,Mailboxes,Forwards',
+        'a@example.com,a_box,',
+        'b@example.com,,x@example.org; y@example.org',
+    ]),
+    ('tsv', [
+        'Email\tMailboxes\tForwards',
+        'a@example.com\ta_box\t',
+        'b@example.com\t\tx@example.org; y@example.org',
+    ]),
+])
+def test_cli_list_emails_formats(request, monkeypatch, capsys,
+                                 output_format, expected):
+    from pywebfaction import cli
+
+    server = fake_server(request, emails={
+        'a@example.com': 'a_box',
+        'b@example.com': 'x@example.org,y@example.org',
+    })
+    monkeypatch.setattr(
+        cli,
+        'get_handle',
+        lambda: WebFactionAPI('theuser', 'foobar', endpoint=server.endpoint)
+    )
+
+    cli.main(['list_emails', '--format=%s' % output_format])
+
+    assert capsys.readouterr()[0].splitlines() == expected
+
+
+def test_cli_list_emails_unknown_format(capsys):
+    from pywebfaction import cli
+
+    assert cli.main(['list_emails', '--format=xml']) == 1
+    assert 'Unknown format xml' in capsys.readouterr()[0]
+
+
+@pytest.mark.parametrize(('message', 'expected'), [
+    ("[u'It all went wrong.', u'Again.']", 'It all went wrong.'),
+    (" ['Leading space.']", 'Leading space.'),
+    ('[u"Don\'t do that."]', "Don't do that."),
+    ("[u'Line one\\nline two']", 'Line one\nline two'),
+    ("[u'Mailbox exists.', <object at 0x1>]", 'Mailbox exists.'),
+    ("[1, 2]", 1),
+    ("[u'never closed", None),
+    ("[" * 1000 + "]" * 1000, None),
+    ("method \"system.multicall\" is not supported", None),
+])
+def test_exception_parsing_messages(message, expected):
+    err = _get_fault(
+        '<class \'webfaction_api.exceptions.DataError\'>:' + message
+    )
+
+    assert err.exception_type == 'DataError'
+    assert err.exception_message == expected
+
+
+def test_exception_parsing_is_lazy():
+    err = _get_fault(
+        '<class \'webfaction_api.exceptions.DataError\'>:'
+        '[u\'It all went wrong.\']'
+    )
+
+    assert err._parts is None
+    assert err.exception_type == 'DataError'
+    assert err._exception_message != 'It all went wrong.'
+    assert err.exception_message == 'It all went wrong.'
+
+
+def test_reconcile_plan():
+    desired = parse_desired_state({
+        'new@example.com': {'mailboxes': ['new_box'],
+                            'forwards_to': ['x@example.org']},
+        'same@example.com': ['y@example.org', 'same_box'],
+        'changed@example.com': {'forwards_to': ['z@example.org']},
+    })
+    emails = [
+        Email({'email_address': 'same@example.com',
+               'targets': 'same_box,y@example.org'}),
+        Email({'email_address': 'changed@example.com',
+               'targets': 'y@example.org'}),
+        Email({'email_address': 'old@example.com',
+               'targets': 'old_box'}),
+    ]
+
+    assert plan(desired, emails, ['same_box', 'old_box']) == [
+        Change(CREATE_MAILBOX, 'new_box'),
+        Change(UPDATE, 'changed@example.com', ['z@example.org']),
+        Change(CREATE, 'new@example.com', ['new_box', 'x@example.org']),
+        Change(DELETE, 'old@example.com'),
+    ]
+    assert plan(desired, emails, ['same_box', 'new_box'],
+                delete=False) == [
+        Change(UPDATE, 'changed@example.com', ['z@example.org']),
+        Change(CREATE, 'new@example.com', ['new_box', 'x@example.org']),
+    ]
+    assert str(Change(CREATE, 'a@example.com', ['a_box', 'b@x.org'])) == (
+        '+ a@example.com -> a_box, b@x.org'
+    )
+
+
+@pytest.mark.parametrize('desired_state', [
+    ['a@example.com'],
+    {'a@example.com': []},
+    {'a@example.com': {'mailbox': 'a_box'}},
+    {'a@example.com': 'a_box'},
+])
+def test_reconcile_rejects_bad_desired_state(desired_state):
+    with pytest.raises(ValueError):
+        parse_desired_state(desired_state)
+
+
+def test_reconcile(request):
+    server = fake_server(request, mailboxes=['same_box'], emails={
+        'same@example.com': 'same_box',
+        'changed@example.com': 'y@example.org',
+        'old@example.com': 'same_box',
+    })
+    api = WebFactionAPI('theuser', 'foobar', endpoint=server.endpoint)
+    desired_state = {
+        'new@example.com': {'mailboxes': ['new_box']},
+        'same@example.com': {'mailboxes': ['same_box']},
+        'changed@example.com': {'forwards_to': ['z@example.org']},
+    }
+
+    changes = api.reconcile(desired_state, dry_run=True)
+    assert [c.action for c in changes] == [
+        CREATE_MAILBOX, UPDATE, CREATE, DELETE
+    ]
+    assert 'old@example.com' in server.emails
+
+    applied = api.reconcile(desired_state, max_workers=2)
+
+    # Everything is done before reconcile returns.
+    assert set(server.mailboxes) == set(['same_box', 'new_box'])
+    assert server.emails == {
+        'same@example.com': 'same_box',
+        'changed@example.com': 'z@example.org',
+        'new@example.com': 'new_box',
+    }
+
+    results = dict((change.action, result) for change, result in applied)
+    assert results[CREATE_MAILBOX]['password'] == server.mailboxes['new_box']
+    assert api.reconcile(desired_state, dry_run=True) == []
+
+
+def test_reconcile_skips_emails_for_failed_mailboxes(request):
+    server = fake_server(request, mailboxes=['taken_box'])
+    changes = [
+        Change(CREATE_MAILBOX, 'taken_box'),
+        Change(CREATE, 'a@example.com', ['taken_box']),
+        Change(CREATE, 'b@example.com', ['b@example.org']),
+    ]
+    api = WebFactionAPI('theuser', 'foobar', endpoint=server.endpoint)
+
+    results = dict(
+        (change.name, result)
+        for change, result in apply_changes(api, changes)
+    )
+
+    assert isinstance(results['taken_box'], WebFactionFault)
+    assert isinstance(results['a@example.com'], ValueError)
+    assert server.emails == {'b@example.com': 'b@example.org'}
+
+
+def test_cli_sync(request, tmpdir, monkeypatch, capsys):
+    from pywebfaction import cli
+
+    server = fake_server(request, mailboxes=['same_box'],
+                         emails={'old@example.com': 'same_box'})
+    monkeypatch.setattr(
+        cli,
+        'get_handle',
+        lambda: WebFactionAPI('theuser', 'foobar', endpoint=server.endpoint)
+    )
+    state = tmpdir.join('emails.yaml')
+    state.write('new@example.com:\n  forwards_to: [x@example.org]\n')
+
+    assert cli.main(['sync', str(state), '--dry-run']) == 0
+    assert capsys.readouterr()[0].splitlines() == [
+        '+ new@example.com -> x@example.org',
+        '- old@example.com',
+    ]
+    assert 'new@example.com' not in server.emails
+
+    assert cli.main(['sync', str(state), '--no-delete']) == 0
+    output = capsys.readouterr()[0].splitlines()
+    assert output[0] == '+ new@example.com -> x@example.org'
+    assert json.loads(output[1]) == {
+        'action': 'create',
+        'name': 'new@example.com',
+        'targets': ['x@example.org'],
+    }
+    assert server.emails == {
+        'old@example.com': 'same_box',
+        'new@example.com': 'x@example.org',
+    }
+
+
+def test_watch_diff():
+    def emails(**targets):
+        return [
+            Email({'email_address': address + '@example.com',
+                   'targets': target})
+            for address, target in sorted(targets.items())
+        ]
+
+    snapshot, changes = diff(None, emails(a='a_box', b='b_box'))
+    assert changes == []
+    assert sorted(snapshot) == ['a@example.com', 'b@example.com']
+
+    snapshot, changes = diff({}, emails(a='a_box', b='b_box'))
+    assert [(c.kind, c.address) for c in changes] == [
+        (ADDED, 'a@example.com'), (ADDED, 'b@example.com'),
+    ]
+
+    snapshot, changes = diff(snapshot, emails(a='a_box', b='b_box'))
+    assert changes == []
+
+    snapshot, changes = diff(snapshot, emails(b='x@example.org', c='c_box'))
+    assert [(c.kind, c.address) for c in changes] == [
+        (CHANGED, 'b@example.com'),
+        (ADDED, 'c@example.com'),
+        (REMOVED, 'a@example.com'),
+    ]
+    assert changes[0].to_dict() == {
+        'change': 'changed',
+        'address': 'b@example.com',
+        'mailboxes': [],
+        'forwards_to': ['x@example.org'],
+    }
+    assert changes[2].email is None
+    assert sorted(snapshot) == ['b@example.com', 'c@example.com']
+
+
+def test_watcher_adapts_interval(request):
+    server = fake_server(request, emails={'a@example.com': 'a_box'})
+    api = WebFactionAPI('theuser', 'foobar', endpoint=server.endpoint)
+    sleeps = []
+    watcher = api.watch(min_interval=10, max_interval=50,
+                        sleep=sleeps.append)
+
+    assert watcher.poll() == []
+    assert watcher.poll() == []
+    assert watcher.poll() == []
+    assert watcher.interval == 40
+    assert watcher.poll() == []
+    assert watcher.interval == 50
+
+    server.emails['b@example.com'] = 'b@example.org'
+    changes = iter(watcher)
+    change = next(changes)
+    assert (change.kind, change.address) == (ADDED, 'b@example.com')
+    assert watcher.interval == 10
+    assert sleeps == []
+
+    del server.emails['a@example.com']
+    change = next(changes)
+    assert (change.kind, change.address) == (REMOVED, 'a@example.com')
+    assert sleeps == [10]
+
+
+def test_watcher_keeps_going_after_errors(request):
+    server = fake_server(request)
+    api = WebFactionAPI('theuser', 'foobar', endpoint=server.endpoint,
+                        retry_policy=RetryPolicy(max_attempts=1))
+    sleeps = []
+    errors = []
+    watcher = api.watch(min_interval=10, max_interval=50,
+                        sleep=sleeps.append, on_error=errors.append)
+    changes = iter(watcher)
+
+    server.emails['a@example.com'] = 'a_box'
+    watcher.poll()
+    server.fail_next('list_emails', times=2)
+    server.emails['b@example.com'] = 'b_box'
+
+    change = next(changes)
+    assert (change.kind, change.address) == (ADDED, 'b@example.com')
+    assert [e.exception_type for e in errors] == ['ServerError'] * 2
+    assert sleeps == [20, 40]
+
+
+def test_pooled_transport_gzip_responses(request):
+    entries = sample_emails(500)
+    server = fake_server(
+        request,
+        mailboxes=[targets.split(',')[0] for _, targets in entries],
+        emails=entries,
+    )
+    counter = CallCounter()
+    api = WebFactionAPI('theuser', 'foobar', endpoint=server.endpoint,
+                        observers=[counter])
+    plain_size = len(xmlrpc_client.dumps(([
+        {'id': 1, 'email_address': address, 'targets': targets}
+        for address, targets in entries
+    ], ), methodresponse=True))
+
+    emails = api.list_emails()
+    assert len(emails) == 500
+    assert emails[0].mailboxes == ['user0_examplecom']
+    assert counter.response_bytes['list_emails'] < plain_size / 4
+
+    assert len(api.list_mailboxes()) == 500
+    assert counter.response_bytes['list_mailboxes'] < plain_size / 4
+
+    api.transport.accept_gzip_encoding = False
+    api.list_emails()
+    assert counter.response_bytes['list_emails'] > plain_size
+
+
+def test_pooled_transport_limits_decompressed_size(request):
+    server = fake_server(
+        request,
+        mailboxes=['box%d' % i for i in range(2000)],
+        emails=sample_emails(2000),
+    )
+    transport = PooledTransport(use_https=False, max_decoded_size=50000)
+    api = WebFactionAPI('theuser', 'foobar', endpoint=server.endpoint,
+                        transport=transport)
+
+    with pytest.raises(ValueError):
+        api.list_mailboxes()
+    with pytest.raises(ValueError):
+        api.list_emails()
+
+    transport.max_decoded_size = None
+    assert len(api.list_mailboxes()) == 2000
+    assert len(api.list_emails()) == 2000
+
+
+def test_pooled_transport_gzip_requests(request):
+    server = fake_server(request)
+    api = WebFactionAPI('theuser', 'foobar', endpoint=server.endpoint)
+    targets = ['forward%d@example.org' % i for i in range(500)]
+
+    api.create_email_forwarder('foo@example.com', targets)
+
+    assert server.emails == {'foo@example.com': ','.join(targets)}
+    assert api.transport.last_request_size < len(','.join(targets)) / 4
+
+
+class NoGzipRequestHandler(KeepAliveRequestHandler):
+    def decode_request_content(self, data):
+        if self.headers.get('content-encoding'):
+            self.send_response(415)
+            self.send_header('Content-length', '0')
+            self.end_headers()
+            return None
+        return data
+
+
+class NoGzipServer(FakeWebFactionServer):
+    request_handler = NoGzipRequestHandler
+
+
+def test_pooled_transport_stops_gzipping_rejected_requests(request):
+    server = NoGzipServer().start()
+    request.addfinalizer(server.stop)
+    api = WebFactionAPI('theuser', 'foobar', endpoint=server.endpoint)
+    targets = ['forward%d@example.org' % i for i in range(500)]
+
+    api.create_email_forwarder('foo@example.com', targets)
+    api.create_email_forwarder('bar@example.com', targets)
+
+    assert sorted(server.emails) == ['bar@example.com', 'foo@example.com']
+    assert api.transport.encode_threshold is None
+
+
+def accounts_server(request):
+    return fake_server(
+        request,
+        users={'alice': 'secret', 'bob': 'secret'},
+        emails={'a@example.com': 'a_box', 'b@example.com': 'b_box'},
+    )
+
+
+def test_accounts_fan_out(request):
+    server = accounts_server(request)
+    accounts = WebFactionAccounts(
+        {
+            'work': ('alice', 'secret'),
+            'home': ('bob', 'secret'),
+            'broken': ('carol', 'wrong'),
+        },
+        endpoint=server.endpoint,
+    )
+
+    assert [(name, str(email)) for name, email in accounts.list_emails()] == [
+        ('home', 'a@example.com'),
+        ('home', 'b@example.com'),
+        ('work', 'a@example.com'),
+        ('work', 'b@example.com'),
+    ]
+    assert list(accounts.errors) == ['broken']
+    assert accounts.errors['broken'].exception_type == 'LoginError'
+    assert sorted(accounts.apis) == ['home', 'work']
+
+    server.fail_next('list_mailboxes', times=2, fault_type='DataError')
+    assert accounts.call('list_mailboxes') == {}
+    assert sorted(accounts.errors) == ['broken', 'home', 'work']
+
+
+def test_accounts_from_config(tmpdir):
+    config = tmpdir.join('pywebfaction.ini')
+    config.write(
+        '[pywebfaction]\nusername = alice\npassword = secret\n\n'
+        '[other]\nusername = bob\npassword = hunter2\n\n'
+        '[settings]\ncolour = blue\n'
+    )
+
+    accounts = WebFactionAccounts.from_config(str(config))
+
+    assert accounts.names == ['other', 'pywebfaction']
+    assert accounts.credentials['other'] == ('bob', 'hunter2')
+
+
+def test_cli_list_emails_all_accounts(request, monkeypatch, capsys):
+    from pywebfaction import cli
+
+    server = accounts_server(request)
+    monkeypatch.setattr(cli, 'get_accounts', lambda: WebFactionAccounts(
+        {'work': ('alice', 'secret'), 'home': ('bob', 'secret')},
+        endpoint=server.endpoint,
+    ))
+
+    assert cli.main(['list_emails', '--all-accounts', '--format=csv']) == 0
+    assert capsys.readouterr()[0].splitlines() == [
+        'Account,Email,Mailboxes,Forwards',
+        'home,a@example.com,a_box,',
+        'home,b@example.com,b_box,',
+        'work,a@example.com,a_box,',
+        'work,b@example.com,b_box,',
+    ]
+
+
+def test_token_bucket():
+    clock = FakeClock()
+    sleeps = []
+
+    def sleep(delay):
+        sleeps.append(delay)
+        clock.now += delay
+
+    bucket = TokenBucket(rate=2, burst=3, clock=clock, sleep=sleep)
+
+    for _ in range(5):
+        bucket.acquire()
+    assert sleeps == [0.5, 0.5]
+
+    clock.now += 10
+    for _ in range(3):
+        bucket.acquire()
+    assert sleeps == [0.5, 0.5]
+
+
+def test_rate_limiter_is_per_method():
+    sleeps = []
+    limiter = RateLimiter({'create_email': (1, 1)}, clock=FakeClock(),
+                          sleep=sleeps.append)
+
+    for _ in range(3):
+        limiter.acquire('list_emails')
+    assert sleeps == []
+
+    limiter.acquire('create_email')
+    limiter.acquire('create_email')
+    assert sleeps == [1.0]
+
+
+def test_adaptive_concurrency_aimd():
+    controller = AdaptiveConcurrency(initial=4, maximum=6)
+
+    for _ in range(4):
+        controller.release(controller.acquire(), 0.01)
+    assert controller.limit == 5
+
+    tickets = [controller.acquire() for _ in range(3)]
+    for ticket in tickets:
+        controller.release(ticket, 0.01, overloaded=True)
+    # Only the first of the failures which were in flight together
+    # counts.
+    assert controller.limit == 2
+
+    controller.release(controller.acquire(), 5.0)
+    assert controller.limit == 1
+
+    for _ in range(100):
+        controller.release(controller.acquire(), 0.01)
+    assert controller.limit == 6
+
+
+def test_adaptive_concurrency_latency_is_per_method():
+    controller = AdaptiveConcurrency(initial=4)
+
+    for _ in range(4):
+        controller.release(controller.acquire(), 0.01, method='login')
+        controller.release(controller.acquire(), 2.0, method='list_emails')
+    assert controller.limit == 5
+
+    controller.release(controller.acquire(), 2.0, method='login')
+    assert controller.limit == 2
+
+
+def test_throttle_waits_respect_timeouts():
+    sleeps = []
+    bucket = TokenBucket(rate=1, burst=1, clock=FakeClock(),
+                         sleep=sleeps.append)
+
+    bucket.acquire(timeout=0.5)
+    with pytest.raises(socket.timeout) as e:
+        bucket.acquire(timeout=0.5)
+    assert not request_sent(e.value)
+    bucket.acquire(timeout=2)
+    assert sleeps == [1.0]
+
+    controller = AdaptiveConcurrency(initial=1)
+    controller.acquire()
+    start = time.time()
+    with pytest.raises(socket.timeout) as e:
+        controller.acquire(timeout=0.1)
+    assert time.time() - start < 0.5
+    assert not request_sent(e.value)
+
+
+def test_rate_limited_call_times_out(request):
+    server = fake_server(request)
+    api = WebFactionAPI('theuser', 'foobar', endpoint=server.endpoint,
+                        rate_limiter=RateLimiter(default=(0.5, 1)))
+
+    api.create_email_forwarder('a@example.com', ['b@example.org'])
+
+    start = time.time()
+    with pytest.raises(socket.timeout):
+        api.create_email_forwarder('c@example.com', ['b@example.org'],
+                                   timeout=0.2)
+    assert time.time() - start < 0.2
+    assert 'c@example.com' not in server.emails
+
+
+def test_rate_limited_create_email_rolls_back_without_listing(request):
+    server = fake_server(request)
+    api = WebFactionAPI(
+        'theuser', 'foobar', endpoint=server.endpoint,
+        rate_limiter=RateLimiter({'create_email': (0.1, 1)}),
+    )
+
+    api.create_email('a@example.com')
+
+    with pytest.raises(socket.timeout):
+        api.create_email('b@example.com', timeout=1)
+
+    # The create_email request never left, so the mailbox can go
+    # without checking whether the email exists.
+    assert server.calls['create_email'] == 1
+    assert server.calls['list_emails'] == 0
+    assert list(server.mailboxes) == ['a_examplecom']
+
+
+def test_adaptive_concurrency_is_opt_in(request):
+    server = fake_server(request)
+    api = WebFactionAPI('theuser', 'foobar', endpoint=server.endpoint)
+
+    assert api.concurrency is None
+    assert api.create_email_forwarder('a@example.com', ['b@example.org'])
+
+
+def test_adaptive_concurrency_limits_calls_in_flight():
+    controller = AdaptiveConcurrency(initial=2, maximum=2)
+    lock = threading.Lock()
+    in_flight = []
+    peak = [0]
+
+    def call():
+        ticket = controller.acquire()
+        with lock:
+            in_flight.append(1)
+            peak[0] = max(peak[0], len(in_flight))
+        time.sleep(0.01)
+        with lock:
+            in_flight.pop()
+        controller.release(ticket, 0.01)
+
+    threads = [threading.Thread(target=call) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert peak[0] == 2
+    assert controller.in_flight == 0
+
+
+def test_api_backs_off_when_overloaded(request):
+    server = fake_server(request)
+    server.fail_next('create_email', times=2)
+    sleeps = []
+    api = WebFactionAPI(
+        'theuser', 'foobar', endpoint=server.endpoint,
+        retry_policy=RetryPolicy(sleep=lambda delay: None),
+        rate_limiter=RateLimiter(default=(1, 1), clock=FakeClock(),
+                                 sleep=sleeps.append),
+        concurrency=AdaptiveConcurrency(initial=8),
+    )
+
+    assert api.create_email_forwarder('a@example.com', ['b@example.org']) == 1
+    assert api.concurrency.limit == 2
+    assert len(sleeps) == 2
+
+
+def test_fake_server_keeps_state(request):
+    server = fake_server(request)
+    api = WebFactionAPI('theuser', 'foobar', endpoint=server.endpoint)
+
+    response = api.create_email('me@example.com')
+    api.create_email_forwarder('sales@example.com', ['me@example.com'])
+
+    assert response.mailbox == 'me_examplecom'
+    assert api.list_mailboxes() == ['me_examplecom']
+    assert sorted(e.address for e in api.list_emails()) == [
+        'me@example.com', 'sales@example.com'
+    ]
+
+    with pytest.raises(WebFactionFault) as e:
+        api.create_email_forwarder('me@example.com', ['x@example.org'])
+
+    assert e.value.exception_type == 'DataError'
+    assert e.value.exception_message == EMAIL_EXISTS
+
+    # The mailbox name is taken, so the next one gets a suffix.
+    server.create_mailbox(server.login('theuser', 'foobar')[0],
+                          'me_exampleorg')
+    assert api.create_email('me@example.org').mailbox == 'me_exampleorg1'
+
+
+def test_fake_server_faults_match_webfaction(request):
+    server = fake_server(request)
+    session_id = server.login('theuser', 'foobar')[0]
+    server.create_mailbox(session_id, 'me_examplecom')
+
+    with pytest.raises(Fault) as e:
+        server.create_mailbox(session_id, 'me_examplecom')
+
+    error = WebFactionFault(e.value)
+    assert error.exception_type == 'DataError'
+    assert error.exception_message == MAILBOX_EXISTS
+
+
+def test_fake_server_checks_credentials_and_sessions(request):
+    server = fake_server(request, users={'theuser': 'foobar'})
+
+    with pytest.raises(WebFactionFault) as e:
+        WebFactionAPI('theuser', 'wrong', endpoint=server.endpoint)
+    assert e.value.exception_type == 'LoginError'
+
+    api = WebFactionAPI('theuser', 'foobar', endpoint=server.endpoint)
+    server.expire_sessions()
+
+    assert api.list_emails() == []
+    assert server.calls['login'] == 3
+
+
+def test_fake_server_multicall_faults_one_call_at_a_time(request):
+    server = fake_server(request)
+    server.fail_next('create_email', fault_type='DataError')
+    api = WebFactionAPI('theuser', 'foobar', endpoint=server.endpoint)
+
+    with api.batch() as batch:
+        first = batch.create_email_forwarder('a@example.com', ['x@y.com'])
+        second = batch.create_email_forwarder('b@example.com', ['x@y.com'])
+
+    assert api.supports_multicall
+    assert first.fault.exception_type == 'DataError'
+    assert second.result() == 1
+    assert server.calls['create_email'] == 2
+
+
+def test_fake_server_injects_faults(request):
+    server = fake_server(request, fault_rate=0.5, seed=1)
+    api = WebFactionAPI(
+        'theuser', 'foobar', endpoint=server.endpoint,
+        retry_policy=RetryPolicy(max_attempts=1),
+    )
+
+    results = [
+        result for _, result in api.create_email_forwarders(
+            (('user%d@example.com' % i, ['me@example.com'])
+             for i in range(40)),
+            max_workers=4
+        )
+    ]
+    failed = [r for r in results if isinstance(r, WebFactionFault)]
+
+    assert 5 < len(failed) < 35
+    assert all(r.exception_type == 'ServerError' for r in failed)
+    assert len(server.emails) == 40 - len(failed)
+
+
+def test_fake_server_handles_concurrent_clients(request):
+    server = fake_server(request, latency=0.02, jitter=0.01)
+    api = WebFactionAPI('theuser', 'foobar', endpoint=server.endpoint)
+
+    start = time.time()
+    results = list(api.create_email_forwarders(
+        (('user%d@example.com' % i, ['me@example.com']) for i in range(16)),
+        max_workers=8
+    ))
+
+    assert len(server.emails) == 16
+    assert not [r for _, r in results if isinstance(r, Exception)]
+    assert server.max_in_flight > 1
+    # Sixteen calls one after the other would take at least 0.32s.
+    assert time.time() - start < 0.3